@@ -0,0 +1,81 @@
+import time
+
+import torch
+
+
+class CompiledDenoiser(object):
+    """Runs the RoFormer denoiser through `torch.compile` graphs with static shapes.
+
+    Inputs are padded up to a (batch, figure_size) bucket: extra time units are empty tokens
+    masked out of attention, extra rows are fully masked copies, and the output is cut back to
+    the real shape, so every bucket is compiled once and reused. The band attention used above
+    512 time units is built inside the RoFormer from the padded 2-D mask, so a bucket that large is
+    traced with it like any other. Inputs larger than every bucket and buckets whose compilation
+    failed go through the eager module instead. It is not an nn.Module on purpose, so it never
+    shows up in state dicts.
+    """
+
+    def __init__(self, denoiser, empty_index, lengths=(64, 128, 256, 512), batch_sizes=(1, 2, 4, 8), mode=None):
+        self.eager = denoiser
+        self.empty_index = empty_index
+        self.lengths = sorted(lengths)
+        self.batch_sizes = sorted(batch_sizes)
+        self.mode = mode
+
+        self._compiled = {}
+        self._failed = set()
+
+        # bucket 마다 graph 가 하나씩 생기므로 dynamo 의 recompile 한도를 bucket 수에 맞춤
+        import torch._dynamo
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit,
+                                                    len(self.lengths) * len(self.batch_sizes))
+
+    def _bucket(self, batch_size, figure_size):
+        b = next((s for s in self.batch_sizes if s >= batch_size), None)
+        l = next((s for s in self.lengths if s >= figure_size), None)
+        if b is None or l is None:
+            return None
+        return b, l
+
+    def _graph(self, key):
+        if key not in self._compiled:
+            self._compiled[key] = torch.compile(self.eager, dynamic=False, mode=self.mode)
+        return self._compiled[key]
+
+    def __call__(self, x, timesteps, condition_pos, attention_mask=None):
+        batch_size = x.size(0)
+        figure_size = x.size(1) // 14
+        key = self._bucket(batch_size, figure_size)
+        if key is None or key in self._failed:
+            return self.eager(x, timesteps, condition_pos, attention_mask=attention_mask)
+
+        b, l = key
+        device = x.device
+        x_pad = torch.full((b, 14, l), self.empty_index, dtype=x.dtype, device=device)
+        x_pad[:batch_size, :, :figure_size] = x.view(batch_size, 14, figure_size)
+        cond_pad = torch.zeros((b, 14, l), dtype=condition_pos.dtype, device=device)
+        cond_pad[:batch_size, :, :figure_size] = condition_pos.view(batch_size, 14, figure_size)
+        mask_pad = torch.zeros((b, l), device=device)
+        if attention_mask is None:
+            mask_pad[:batch_size, :figure_size] = 1
+        else:
+            mask_pad[:batch_size, :figure_size] = attention_mask
+        mask_pad[batch_size:, 0] = 1
+        t_pad = torch.zeros((b,), dtype=timesteps.dtype, device=device)
+        t_pad[:batch_size] = timesteps
+
+        try:
+            start = time.time()
+            first = key not in self._compiled
+            out = self._graph(key)(x_pad.view(b, -1), t_pad, cond_pad.view(b, -1), attention_mask=mask_pad)
+            if first:
+                print(f"compiled denoiser for batch {b}, figure size {l} in {time.time() - start:.1f}s")
+        except Exception as e:
+            # compile 이 안 되는 bucket 은 이후 eager 로만 실행
+            print(f"compiling denoiser for {key} failed, falling back to eager: {e}")
+            self._failed.add(key)
+            return self.eager(x, timesteps, condition_pos, attention_mask=attention_mask)
+
+        # output 은 (b, (t l), vocab) 순서
+        out = out.view(b, 14, l, -1)[:batch_size, :, :figure_size]
+        return out.reshape(batch_size, 14 * figure_size, -1)
@@ -100,9 +100,10 @@ class Solver(object):
         self.logger.log_info(str(get_model_parameters_info(self.model)))
         self.args.local_rank=0
         
-        self.model.to(self.args.local_rank)
+        # initialize 에서 정한 device (cpu / cuda:N), 없으면 예전처럼 local_rank 번 GPU
+        self.device = getattr(self.args, 'device', None) or torch.device('cuda', self.args.local_rank)
+        self.model.to(self.device)
         
-        self.device = self.args.local_rank
         print('self.device ',self.device)
 
         if self.args.distributed:
@@ -294,7 +295,7 @@ class Solver(object):
             path = os.path.join(self.ckpt_dir, 'last.pth')
 
         if os.path.exists(path):
-            state_dict = torch.load(path, map_location='cuda:{}'.format(self.args.local_rank))
+            state_dict = torch.load(path, map_location=self.device)
 
             if load_others:
                 self.last_epoch = state_dict['last_epoch']
@@ -494,6 +495,12 @@ class Solver(object):
             self.train_epoch()
             
     def infer_sample(self, x, tempo, not_empty_pos, condition_pos, use_ema=True, skip_step=0):
+        assert x.size()[0] == 1
+        return self.infer_batch([x[0]], [tempo], [not_empty_pos], [condition_pos], use_ema=use_ema, skip_step=skip_step)[0]
+
+    def infer_batch(self, xs, tempos, not_empty_poss, condition_poss, use_ema=True, skip_step=0):
+        # xs: list of (14, figure_size) tensors which may have different figure sizes.
+        # they are right-padded with empty tokens to the longest one and masked out in attention.
         self.model.eval()
         tic = time.time()
         
@@ -506,113 +513,129 @@ class Solver(object):
         else:  
             model = self.model 
 
-        with torch.no_grad(): 
-            x = x.cuda()
-            tempo = tempo.cuda()
-            not_empty_pos = not_empty_pos.cuda()
-            condition_pos = condition_pos.cuda()
-            assert x.size()[0] == 1
-            ts = 6
-
-            samples = model.infer_sample(x, tempo, not_empty_pos, condition_pos, skip_step=skip_step)
+        empty_index = model.rfm.num_classes - 2
+        lengths = [x.size()[-1] for x in xs]
+        max_len = max(lengths)
+        batch_size = len(xs)
 
-            print('sampling, the song has {} time units'.format(samples.size()[-1]))
+        with torch.no_grad(): 
+            x = torch.full((batch_size, 14, max_len), empty_index, dtype=torch.long)
+            not_empty_pos = torch.zeros(batch_size, 14, max_len)
+            condition_pos = torch.zeros(batch_size, 14, max_len)
+            attention_mask = torch.zeros(batch_size, max_len)
+            for i, length in enumerate(lengths):
+                x[i, :, :length] = xs[i].view(14, -1).long()
+                not_empty_pos[i, :, :length] = not_empty_poss[i].view(14, -1)
+                condition_pos[i, :, :length] = condition_poss[i].view(14, -1)
+                attention_mask[i, :length] = 1
+
+            x = x.to(self.device)
+            not_empty_pos = not_empty_pos.to(self.device)
+            condition_pos = condition_pos.to(self.device)
+            attention_mask = attention_mask.to(self.device)
+
+            samples = model.infer_sample(x, None, not_empty_pos, condition_pos, skip_step=skip_step, attention_mask=attention_mask)
+
+            print('sampling {} songs with {} time units in {:.2f}s'.format(batch_size, max_len, time.time() - tic))
+
+        oct_lines = [self.decode_sample(samples[i][:, :length], tempos[i]) for i, length in enumerate(lengths)]
+        
+        if use_ema and self.ema is not None:
+            self.ema.modify_to_train()
 
-            datum = samples[0]
-            
-            
-            encoding = []
-            for t in range(samples.size()[-1]):
-                bar = t // self.pos_in_bar
-                pos = t % self.pos_in_bar
-                main_pitch = datum[0][t].item()
-                main_dur = datum[1][t].item()
-                assert (main_dur <= self.pad_index) and (main_pitch >= self.pad_index), 'pitch index is {} and dur index is {}'.format(main_pitch, main_dur)
-                if (main_pitch != self.pad_index) and (main_dur < self.pad_index):
-                    p = self.ids_to_tokens[main_pitch]
-                    if p[0] == 'M':
-                        p = p[1:]
-                        encoding.append((bar,pos,80,p,self.ids_to_tokens[main_dur][1:],28,ts,tempo))
-                    else:
-                        print('out m')
-
-                bass_pitch = datum[2][t].item()
-                bass_dur = datum[3][t].item()
-                assert bass_dur <= self.pad_index and bass_pitch >= self.pad_index, "{}, {}".format(bass_dur, bass_pitch)
-                if (bass_pitch != self.pad_index) and (bass_dur < self.pad_index):
-                    pitch = self.ids_to_tokens[bass_pitch]
-                    dur = self.ids_to_tokens[bass_dur]
-                    if pitch[0] == 'B':
-                        pitch = pitch[1:].split(' ')
-                        for p in pitch:
-                            encoding.append((bar,pos,32,p,dur[1:],24,ts,tempo))
-                    else:
-                        print('out b')
-                        
-                drums_pitch = datum[4][t].item() # 128
-                drums_dur = datum[5][t].item()
-                assert drums_dur <= self.pad_index and drums_pitch >= self.pad_index, "{}, {}".format(drums_dur, drums_pitch)
-                if (drums_pitch != self.pad_index) and (drums_dur < self.pad_index):
-                    pitch = self.ids_to_tokens[drums_pitch]
-                    dur = self.ids_to_tokens[drums_dur]
-                    if pitch[0] == 'D':
-                        pitch = pitch[1:].split(' ')
-                        for p in pitch:
-                            encoding.append((bar,pos,128,p,dur[1:],24,ts,tempo))
-                    else:
-                        print('out d')
+        return oct_lines
+
+    def decode_sample(self, datum, tempo):
+        ts = 6
+        encoding = []
+        for t in range(datum.size()[-1]):
+            bar = t // self.pos_in_bar
+            pos = t % self.pos_in_bar
+            main_pitch = datum[0][t].item()
+            main_dur = datum[1][t].item()
+            assert (main_dur <= self.pad_index) and (main_pitch >= self.pad_index), 'pitch index is {} and dur index is {}'.format(main_pitch, main_dur)
+            if (main_pitch != self.pad_index) and (main_dur < self.pad_index):
+                p = self.ids_to_tokens[main_pitch]
+                if p[0] == 'M':
+                    p = p[1:]
+                    encoding.append((bar,pos,80,p,self.ids_to_tokens[main_dur][1:],28,ts,tempo))
+                else:
+                    print('out m')
+
+            bass_pitch = datum[2][t].item()
+            bass_dur = datum[3][t].item()
+            assert bass_dur <= self.pad_index and bass_pitch >= self.pad_index, "{}, {}".format(bass_dur, bass_pitch)
+            if (bass_pitch != self.pad_index) and (bass_dur < self.pad_index):
+                pitch = self.ids_to_tokens[bass_pitch]
+                dur = self.ids_to_tokens[bass_dur]
+                if pitch[0] == 'B':
+                    pitch = pitch[1:].split(' ')
+                    for p in pitch:
+                        encoding.append((bar,pos,32,p,dur[1:],24,ts,tempo))
+                else:
+                    print('out b')
+                    
+            drums_pitch = datum[4][t].item() # 128
+            drums_dur = datum[5][t].item()
+            assert drums_dur <= self.pad_index and drums_pitch >= self.pad_index, "{}, {}".format(drums_dur, drums_pitch)
+            if (drums_pitch != self.pad_index) and (drums_dur < self.pad_index):
+                pitch = self.ids_to_tokens[drums_pitch]
+                dur = self.ids_to_tokens[drums_dur]
+                if pitch[0] == 'D':
+                    pitch = pitch[1:].split(' ')
+                    for p in pitch:
+                        encoding.append((bar,pos,128,p,dur[1:],24,ts,tempo))
+                else:
+                    print('out d')
+                    
+            guitar_pitch = datum[6][t].item() # 25
+            guitar_dur = datum[7][t].item()
+            assert guitar_dur <= self.pad_index and guitar_pitch >= self.pad_index, "{}, {}".format(guitar_dur, guitar_pitch)
+            if (guitar_pitch != self.pad_index) and (guitar_dur < self.pad_index):
+                pitch = self.ids_to_tokens[guitar_pitch]
+                dur = self.ids_to_tokens[guitar_dur]
+                if pitch[0] == 'G':
+                    pitch = pitch[1:].split(' ')
+                    for p in pitch:
+                        encoding.append((bar,pos,25,p,dur[1:],20,ts,tempo))
+                else:
+                    print('out g')
                         
-                guitar_pitch = datum[6][t].item() # 25
-                guitar_dur = datum[7][t].item()
-                assert guitar_dur <= self.pad_index and guitar_pitch >= self.pad_index, "{}, {}".format(guitar_dur, guitar_pitch)
-                if (guitar_pitch != self.pad_index) and (guitar_dur < self.pad_index):
-                    pitch = self.ids_to_tokens[guitar_pitch]
-                    dur = self.ids_to_tokens[guitar_dur]
-                    if pitch[0] == 'G':
-                        pitch = pitch[1:].split(' ')
-                        for p in pitch:
-                            encoding.append((bar,pos,25,p,dur[1:],20,ts,tempo))
-                    else:
-                        print('out g')
-                            
-                piano_pitch = datum[8][t].item()
-                piano_dur = datum[9][t].item()
-                assert piano_dur <= self.pad_index and piano_pitch >= self.pad_index, "{}, {}".format(piano_dur, piano_pitch)
-                if (piano_pitch != self.pad_index) and (piano_dur < self.pad_index):
-                    pitch = self.ids_to_tokens[piano_pitch]
-                    dur = self.ids_to_tokens[piano_dur]
-                    if pitch[0] == 'P':
-                        pitch = pitch[1:].split(' ')
-                        for p in pitch:
-                            encoding.append((bar,pos,0,p,dur[1:],24,ts,tempo))
-                    else:
-                        print('out p')
-                            
-                string_pitch = datum[10][t].item() # 48
-                string_dur = datum[11][t].item()
-                assert string_dur <= self.pad_index and string_pitch >= self.pad_index, 'p:{},d:{}'.format(string_pitch,string_dur)
-                if (string_pitch != self.pad_index) and (string_dur < self.pad_index):
-                    pitch = self.ids_to_tokens[string_pitch]
-                    dur = self.ids_to_tokens[string_dur]
-                    if pitch[0] == 'S':
-                        pitch = pitch[1:].split(' ')
-                        for p in pitch:
-                            encoding.append((bar,pos,48,p,dur[1:],12,ts,tempo))
-                    else:
-                        print('out s')
+            piano_pitch = datum[8][t].item()
+            piano_dur = datum[9][t].item()
+            assert piano_dur <= self.pad_index and piano_pitch >= self.pad_index, "{}, {}".format(piano_dur, piano_pitch)
+            if (piano_pitch != self.pad_index) and (piano_dur < self.pad_index):
+                pitch = self.ids_to_tokens[piano_pitch]
+                dur = self.ids_to_tokens[piano_dur]
+                if pitch[0] == 'P':
+                    pitch = pitch[1:].split(' ')
+                    for p in pitch:
+                        encoding.append((bar,pos,0,p,dur[1:],24,ts,tempo))
+                else:
+                    print('out p')
                         
-                # just for chord debug
-                root_id = datum[12][t].item()
-                kind_id = datum[13][t].item()
-                if self.ids_to_tokens[root_id] in root_dict and self.ids_to_tokens[kind_id] in kind_dict:
-                    root = root_dict[self.ids_to_tokens[root_id]]
-                    kind = kind_dict[self.ids_to_tokens[kind_id]]
-                    encoding.append((bar,pos,129,root,kind,1,ts,tempo))
-                   
+            string_pitch = datum[10][t].item() # 48
+            string_dur = datum[11][t].item()
+            assert string_dur <= self.pad_index and string_pitch >= self.pad_index, 'p:{},d:{}'.format(string_pitch,string_dur)
+            if (string_pitch != self.pad_index) and (string_dur < self.pad_index):
+                pitch = self.ids_to_tokens[string_pitch]
+                dur = self.ids_to_tokens[string_dur]
+                if pitch[0] == 'S':
+                    pitch = pitch[1:].split(' ')
+                    for p in pitch:
+                        encoding.append((bar,pos,48,p,dur[1:],12,ts,tempo))
+                else:
+                    print('out s')
+                    
+            # just for chord debug
+            root_id = datum[12][t].item()
+            kind_id = datum[13][t].item()
+            if self.ids_to_tokens[root_id] in root_dict and self.ids_to_tokens[kind_id] in kind_dict:
+                root = root_dict[self.ids_to_tokens[root_id]]
+                kind = kind_dict[self.ids_to_tokens[kind_id]]
+                encoding.append((bar,pos,129,root,kind,1,ts,tempo))
+               
         encoding.sort()
         oct_line = ['<0-{}> <1-{}> <2-{}> <3-{}> <4-{}> <5-{}> <6-{}> <7-{}>'.format(e[0],e[1],e[2],e[3],e[4],e[5],e[6],e[7]) for e in encoding]
-        
-        if use_ema and self.ema is not None:
-            self.ema.modify_to_train()
 
         return ' '.join(oct_line)
@@ -68,6 +68,8 @@ class DiffusionRFM(nn.Module):
         super().__init__()
         
         self.roformer = instantiate_from_config(roformer_config)
+        # inference 용 compile 된 denoiser (models/compiled_denoiser.py), None 이면 eager
+        self.compiled_roformer = None
         self.amp = False
         self.num_classes = self.roformer.vocab_size + 1 # defined in vocabulary, add an additional mask
         self.cond_weight = self.roformer.cond_weight
@@ -118,6 +120,7 @@ class DiffusionRFM(nn.Module):
         self.register_buffer('Lt_count', torch.zeros(self.num_timesteps))
 
         self.prior_ps = 1024   # max number to sample per step
+        self._track_vocab = {}
 
     def multinomial_kl(self, log_prob1, log_prob2):   # compute KL loss on log_prob
         kl = (log_prob1.exp() * (log_prob1 - log_prob2)).sum(dim=1)
@@ -184,19 +187,108 @@ class DiffusionRFM(nn.Module):
         log_sample = index_to_log_onehot(sample, self.num_classes)
         return log_sample
 
+    def track_vocab(self, i, device):
+        # i 번째 row 에서 log_sample_categorical_infer 가 허용하는 token id (chord row 는 None = 전체)
+        key = (i, str(device))
+        if key not in self._track_vocab:
+            if i >= self.tracks - 2:
+                vocab = None
+            elif i % 2 == 1: # duration
+                vocab = torch.arange(0, self.pad_index + 1, device=device)
+            else:
+                start = mc.tracks_start[i // 2]
+                end = mc.tracks_end[i // 2]
+                vocab = torch.cat([torch.tensor([self.pad_index], device=device), torch.arange(start, end + 1, device=device)])
+            self._track_vocab[key] = vocab
+        return self._track_vocab[key]
+
+    def sample_index_infer(self, logits, figure_size):
+        # log_sample_categorical_infer 와 같은 track 별 제한을 둔 Gumbel-max 를 token id 로 바로 반환
+        # 각 track 에서 허용된 column 만 꺼내서 sampling 하므로 (b, num_classes, L) one-hot 을 만들지 않음
+        out = torch.empty(logits.size()[:2], dtype=torch.long, device=logits.device)
+        for i in range(self.tracks):
+            positions = slice(i * figure_size, (i + 1) * figure_size)
+            vocab = self.track_vocab(i, logits.device)
+            track = logits[:, positions] if vocab is None else logits[:, positions].index_select(-1, vocab)
+            uniform = torch.rand_like(track)
+            gumbel_noise = -torch.log(-torch.log(uniform + 1e-30) + 1e-30)
+            idx = (track + gumbel_noise).argmax(dim=-1)
+            out[:, positions] = idx if vocab is None else vocab[idx]
+        return out
+
+    @torch.no_grad()
+    def p_sample_index(self, x, t, figure_size, condition_pos, not_empty_pos, sampled, to_sample, attention_mask=None):
+        # p_sample on token ids: x (b, tracks * figure_size) -> (next x, sampled)
+        # at t = 0 the still masked positions are drawn from the x0 prediction and the unmasked ones are
+        # kept, instead of sampling every position from q_posterior over the full vocabulary
+        logits = self.denoise(x, t, condition_pos, attention_mask=attention_mask).float()
+        masked = x == self.num_classes - 1
+
+        out_idx = self.sample_index_infer(logits, figure_size)
+        last = t == 0
+        if not (t > 0).any():
+            return torch.where(masked, out_idx, x), None
+
+        # max p(x0|xt) of every position, normalized over positions
+        score = (logits.max(dim=-1).values - torch.logsumexp(logits, dim=-1)).exp().softmax(dim=1)
+        del logits
+
+        max_sample_per_step = self.prior_ps
+        out2_idx = x.clone()
+        _score = score.clone()
+        _score[_score.sum(dim=1) < 1e-6] += 1
+
+        # only content has score
+        _score = torch.where(((1 - condition_pos) * not_empty_pos).type(torch.bool), _score, 0)
+        # only mask has score
+        _score[~masked] = 0
+
+        for b in range(x.size()[0]):
+            if t[b] == 0:
+                continue
+            for j in range(6): # do not decode chord
+                track = slice(2*j * figure_size, (2*j+2) * figure_size)
+                __score = _score[b][track]
+
+                if __score.sum() == 0:
+                    continue
+
+                n_sample = min(to_sample[b][j] - sampled[b][j], max_sample_per_step)
+
+                if to_sample[b][j] - sampled[b][j] - n_sample == 1:
+                    n_sample = to_sample[b][j] - sampled[b][j]
+                if n_sample <= 0:
+                    continue
+
+                sel = torch.multinomial(__score, int(n_sample))
+
+                out2_idx[b][track][sel] = out_idx[b][track][sel]
+
+                sampled[b][j] += ((out2_idx[b][track] != self.num_classes - 1).sum() - (~masked[b][track]).sum()).item()
+
+        # samples at the last step are finished with a full sample
+        if last.any():
+            out2_idx[last] = torch.where(masked[last], out_idx[last], x[last])
+        return out2_idx, sampled
+
     def q_sample(self, log_x_start, t):                 # diffusion step, q(xt|x0) and sample xt
         log_EV_qxt_x0 = self.q_pred(log_x_start, t) # log q(xt|x0)
         log_sample = self.log_sample_categorical(log_EV_qxt_x0)
         return log_sample
 
-    def predict_start(self, log_x_t, t, condition_pos):          # p(x0|xt)
-
-        x_t = log_onehot_to_index(log_x_t)
+    def denoise(self, x_t, t, condition_pos, attention_mask=None):
+        # x_t: (b, tracks * figure_size) token ids -> logits (b, tracks * figure_size, num_classes - 2)
         if self.amp == True:
             with autocast():
-                out = self.roformer(x_t, t, condition_pos)
-        else:
-            out = self.roformer(x_t, t, condition_pos)
+                return self.roformer(x_t, t, condition_pos, attention_mask=attention_mask)
+        elif self.compiled_roformer is not None and not self.training:
+            return self.compiled_roformer(x_t, t, condition_pos, attention_mask=attention_mask)
+        return self.roformer(x_t, t, condition_pos, attention_mask=attention_mask)
+
+    def predict_start(self, log_x_t, t, condition_pos, attention_mask=None):          # p(x0|xt)
+
+        x_t = log_onehot_to_index(log_x_t)
+        out = self.denoise(x_t, t, condition_pos, attention_mask=attention_mask)
 
         log_pred = F.log_softmax(out.double(), dim=2).float()
         batch_size = log_x_t.size()[0]
@@ -237,23 +329,25 @@ class DiffusionRFM(nn.Module):
         log_EV_xtmin_given_xt_given_xstart = self.q_pred(q, t-1) + log_qt_one_timestep + q_log_sum_exp
         return torch.clamp(log_EV_xtmin_given_xt_given_xstart, -70, 0) 
         
-    def p_pred(self, log_x, t, condition_pos):
+    def p_pred(self, log_x, t, condition_pos, attention_mask=None):
         if self.parametrization == 'x0':
-            log_x_recon = self.predict_start(log_x, t, condition_pos)
+            log_x_recon = self.predict_start(log_x, t, condition_pos, attention_mask=attention_mask)
             log_model_pred = self.q_posterior(
                 log_x_start=log_x_recon, log_x_t=log_x, t=t)
         elif self.parametrization == 'direct':
-            log_model_pred = self.predict_start(log_x, t, condition_pos)
+            log_model_pred = self.predict_start(log_x, t, condition_pos, attention_mask=attention_mask)
         else:
             raise ValueError
         return log_model_pred, log_x_recon
 
     @torch.no_grad()
-    def p_sample(self, log_x, t, figure_size, condition_pos, not_empty_pos, sampled=None, to_sample=None):               # sample q(xt-1) for next step from  xt, actually is p(xt-1|xt)
-        model_log_prob, log_x_recon = self.p_pred(log_x, t, condition_pos)
+    def p_sample(self, log_x, t, figure_size, condition_pos, not_empty_pos, sampled=None, to_sample=None, attention_mask=None):               # sample q(xt-1) for next step from  xt, actually is p(xt-1|xt)
+        model_log_prob, log_x_recon = self.p_pred(log_x, t, condition_pos, attention_mask=attention_mask)
 
         max_sample_per_step = self.prior_ps  # max number to sample per step
-        if t[0] > 0 and to_sample is not None:
+        if (t > 0).any() and to_sample is not None:
+            # sampled / to_sample: (batch, 7), bookkeeping is kept per sample.
+            # samples of one batch may be at different diffusion steps (continuous batching)
             log_x_idx = log_onehot_to_index(log_x)
 
             # dim=1，vocaburay dimension
@@ -264,33 +358,40 @@ class DiffusionRFM(nn.Module):
 
             out2_idx = log_x_idx.clone()
             _score = score.clone()
-            if _score.sum() < 1e-6:
-                _score += 1
+            _score[_score.sum(dim=1) < 1e-6] += 1
             
             # only content has score
             _score = torch.where(((1 - condition_pos) * not_empty_pos).type(torch.bool), _score, 0)
             # only mask has score
             _score[log_x_idx != self.num_classes - 1] = 0
 
-            for j in range(6): # do not decode chord
-                
-                __score = _score[0][2*j * figure_size : (2*j+2) * figure_size]
-                
-                if __score.sum() == 0:
+            for b in range(log_x_idx.size()[0]):
+                if t[b] == 0:
                     continue
+                for j in range(6): # do not decode chord
+                    track = slice(2*j * figure_size, (2*j+2) * figure_size)
+                    __score = _score[b][track]
                     
-                n_sample = min(to_sample[j] - sampled[j], max_sample_per_step)
+                    if __score.sum() == 0:
+                        continue
+                        
+                    n_sample = min(to_sample[b][j] - sampled[b][j], max_sample_per_step)
 
-                if to_sample[j] - sampled[j] - n_sample == 1:
-                    n_sample = to_sample[j] - sampled[j]
-                if n_sample <= 0:
-                    continue
+                    if to_sample[b][j] - sampled[b][j] - n_sample == 1:
+                        n_sample = to_sample[b][j] - sampled[b][j]
+                    if n_sample <= 0:
+                        continue
+
+                    sel = torch.multinomial(__score, int(n_sample))
+                    
+                    out2_idx[b][track][sel] = out_idx[b][track][sel]
+                    
+                    sampled[b][j] += ((out2_idx[b][track] != self.num_classes - 1).sum() - (log_x_idx[b][track] != self.num_classes - 1).sum()).item()
 
-                sel = torch.multinomial(__score, n_sample.item())
-                
-                out2_idx[0][2*j * figure_size : (2*j+2) * figure_size][sel] = out_idx[0][2*j * figure_size : (2*j+2) * figure_size][sel]
-                
-                sampled[j] += ((out2_idx[0][2*j * figure_size : (2*j+2) * figure_size] != self.num_classes - 1).sum() - (log_x_idx[0][2*j * figure_size : (2*j+2) * figure_size] != self.num_classes - 1).sum()).item()
+            # samples at the last step are finished with a full Gumbel sample
+            last = t == 0
+            if last.any():
+                out2_idx[last] = log_onehot_to_index(self.log_sample_categorical_infer(model_log_prob[last], figure_size))
 
             out = index_to_log_onehot(out2_idx, self.num_classes)
         else:
@@ -489,6 +590,37 @@ class DiffusionRFM(nn.Module):
         self.amp = False
         return out
 
+    def diffusion_steps(self, skip_step=0):
+        # denoiser 를 실행하는 diffusion index (내림차순), skip_step 개씩 건너뛰고 마지막 0 은 항상 포함
+        steps = list(range(self.num_timesteps - 1, -1, -(skip_step + 1)))
+        if steps[-1] != 0:
+            steps.append(0)
+        return steps
+
+    def sampling_schedule(self, num_to_be_generated_per_track, skip_step=0):
+        # how many tokens of each track are unmasked at every diffusion step, (num_timesteps, 7)
+        # with skip_step > 0 the tokens are spread over the strided steps only, the skipped rows stay -1
+        steps = sorted(self.diffusion_steps(skip_step))[1:]
+        num_steps = len(steps)
+        to_be_sampled_per_step = torch.floor(num_to_be_generated_per_track / num_steps)
+        
+        n_sample = to_be_sampled_per_step.unsqueeze(0).repeat(num_steps, 1)
+
+        compensate = num_to_be_generated_per_track - n_sample.sum(0)
+
+        for i in range(6):
+            while compensate[i] > 0:
+                compensate_freq = torch.ceil((num_steps + 1) / compensate[i]).long().item()
+                if compensate_freq > 1:
+                    n_sample[0::compensate_freq, i] += 1
+                compensate[i] = num_to_be_generated_per_track[i] - n_sample.sum(0)[i]
+
+        n_sample = torch.where(n_sample == 0, -1, n_sample)
+        schedule = -torch.ones(self.num_timesteps, 7, device=n_sample.device)
+        schedule[0] = 1
+        schedule[torch.tensor(steps, device=n_sample.device)] = n_sample.float()
+        return schedule.long()
+
     def sample(
             self,
             x,
@@ -496,13 +628,15 @@ class DiffusionRFM(nn.Module):
             not_empty_pos,
             condition_pos,
             skip_step=0,
+            attention_mask=None,
             **kwargs):
 
+        # x: (batch, 14, figure_size). samples of a batch are padded to the same figure_size,
+        # attention_mask (batch, figure_size) marks the real positions.
         batch_size = x.size()[0]
-        assert batch_size == 1
           
-        num_to_be_generated_per_track = (x == self.num_classes - 1).sum(-1)[0]
-        num_to_be_generated_per_track = num_to_be_generated_per_track[0::2] + num_to_be_generated_per_track[1::2]
+        num_to_be_generated_per_track = (x == self.num_classes - 1).sum(-1)
+        num_to_be_generated_per_track = num_to_be_generated_per_track[:, 0::2] + num_to_be_generated_per_track[:, 1::2]
 
         x = x.view(batch_size, -1).long()
         
@@ -514,51 +648,32 @@ class DiffusionRFM(nn.Module):
         figure_size = sample_len // self.tracks
 
         device = self.log_at.device
-        start_step = self.num_timesteps
 
-        log_x_start = index_to_log_onehot(x, self.num_classes)
-        
-        log_pad = torch.ones_like(log_x_start) * -70
-        log_pad[:, self.pad_index, :] = 0
-        log_empty = -70 * torch.ones_like(log_x_start)
-        log_empty[:,-2,:] = 0
-
-        log_p_x_on_y = -70 * torch.ones((batch_size, self.num_classes, sample_len),device=device)
-        log_p_x_on_y[:,-1,:] = 0
-        
-        start_step = self.num_timesteps
-
-        to_be_sampled_per_step = torch.floor(num_to_be_generated_per_track / (self.num_timesteps - 1))
-        
-        self.n_sample = to_be_sampled_per_step.unsqueeze(0).repeat(self.num_timesteps - 1, 1)
+        # token id 와 mask 만 들고 다님 (dense 한 (b, num_classes, L) log one-hot 을 만들지 않음)
+        condition_pos = condition_pos.type(torch.bool)
+        not_empty_pos = not_empty_pos.type(torch.bool)
+        x_start = x
+        x_t = torch.full_like(x, self.num_classes - 1)
+        empty = torch.full_like(x, self.num_classes - 2)
 
-        compensate = num_to_be_generated_per_track - self.n_sample.sum(0)
-
-        for i in range(6):
-            while compensate[i] > 0:
-                compensate_freq = torch.ceil(self.num_timesteps / compensate[i]).long().item()
-                if compensate_freq > 1:
-                    self.n_sample[0::compensate_freq, i] += 1
-                compensate[i] = num_to_be_generated_per_track[i] - self.n_sample.sum(0)[i]
-        
-        self.n_sample = torch.cat([torch.ones(1, 7, device=self.n_sample.device), self.n_sample], dim=0)
-        self.n_sample = torch.where(self.n_sample == 0, -1, self.n_sample).long()
+        self.n_sample = torch.stack([self.sampling_schedule(n, skip_step) for n in num_to_be_generated_per_track], dim=0) # b, T, 7
 
         with torch.no_grad():
-            for diffusion_index in tqdm(range(start_step-1, -1, -1)):
+            # skip_step > 0: 건너뛴 step 에서 unmask 할 token 은 남은 step 들에 나눠서 unmask (denoiser 는 실제 t 로 실행)
+            for diffusion_index in tqdm(self.diffusion_steps(skip_step)):
                 t = torch.full((batch_size,), diffusion_index, device=device, dtype=torch.long)
-                sampled = torch.zeros(7, dtype=torch.long, device=self.n_sample.device)
+                sampled = torch.zeros(batch_size, 7, dtype=torch.long, device=self.n_sample.device)
 
-                while (sampled < self.n_sample[diffusion_index]).any():
-                    log_p_x_on_y = torch.where(condition_pos.unsqueeze(1).type(torch.bool), log_x_start, log_p_x_on_y)
-                    log_p_x_on_y = torch.where((1-not_empty_pos).unsqueeze(1).type(torch.bool), log_empty, log_p_x_on_y)
-                    log_p_x_on_y, sampled = self.p_sample(log_p_x_on_y, t, figure_size, condition_pos, not_empty_pos, sampled, self.n_sample[diffusion_index])     # log_z is log_onehot
+                while (sampled < self.n_sample[:, diffusion_index]).any():
+                    x_t = torch.where(condition_pos, x_start, x_t)
+                    x_t = torch.where(not_empty_pos, x_t, empty)
+                    x_t, sampled = self.p_sample_index(x_t, t, figure_size, condition_pos.float(), not_empty_pos.float(), sampled,
+                                                       self.n_sample[:, diffusion_index], attention_mask=attention_mask)
                     if sampled is None:
                         assert t[0] == 0
                         break
-                    
-            log_p_x_on_y = torch.where(condition_pos.unsqueeze(1).type(torch.bool), log_x_start, log_p_x_on_y)
-            log_p_x_on_y = torch.where((1-not_empty_pos).unsqueeze(1).type(torch.bool), log_pad, log_p_x_on_y)
-            content_token = log_onehot_to_index(log_p_x_on_y) 
+
+            content_token = torch.where(condition_pos, x_start, x_t)
+            content_token = torch.where(not_empty_pos, content_token, torch.full_like(x, self.pad_index))
         
         return content_token.view(batch_size, self.tracks, -1)
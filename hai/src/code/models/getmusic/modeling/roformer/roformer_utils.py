@@ -19,7 +19,8 @@ class DiffusionRoformerModel(nn.Module):
 
         self.input_transformers = DiffusionRoFormerModel(config)
 
-    def forward(self, x, timesteps, condition_pos):
+    def forward(self, x, timesteps, condition_pos, attention_mask=None):
+        # attention_mask: optional (b, figure_size) padding mask, 1 for real positions
         
         b = x.size()[0]
         x_seq_len = x.size()[1]
@@ -27,11 +28,13 @@ class DiffusionRoformerModel(nn.Module):
         x = x.reshape(b, 14, figure_size)
         condition_pos = condition_pos.reshape(b, 14, figure_size)
       
-        attention_mask = None
         # extrapolation
         if not self.training and figure_size > 512:
             e = torch.ones(b, figure_size, figure_size, device=x.device)
-            attention_mask = torch.tril(e, 255) * torch.triu(e, -255)
+            band = torch.tril(e, 255) * torch.triu(e, -255)
+            if attention_mask is not None:
+                band = band * attention_mask[:, None, :].to(band.dtype)
+            attention_mask = band
             
         outputs = self.input_transformers(input_ids=x, token_type_ids=condition_pos, timesteps=timesteps, attention_mask=attention_mask)
     
@@ -0,0 +1,91 @@
+"""Lookup tables shared by track_generation, position_generation, to_oct and the web router.
+
+The key/chord tables (the 1164x1164 transition matrix in particular) are built once, saved as
+.npy files under `HAI_TABLES_DIR` and memory-mapped on the next import, so importing one of
+those modules no longer re-runs the double loop or unpickles key_profile.pickle. The file names
+carry a hash of the parameters they were built from, so changing them never reads a stale table.
+"""
+import os
+import pickle
+import hashlib
+import functools
+
+import numpy as np
+
+from .midi_config import *
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+TABLES_DIR = os.environ.get('HAI_TABLES_DIR', os.path.join(current_dir, 'tables'))
+KEY_PROFILE_PATH = os.path.join(current_dir, 'key_profile.pickle')
+
+chord_pitch_out_of_key_prob = 0.01
+key_change_prob = 0.001
+chord_change_prob = 0.5
+
+pos_in_bar = beat_note_factor * max_notes_per_bar * pos_resolution
+
+# ts / duration table 은 수백 개 정도라 file 로 읽는 것보다 바로 만드는 편이 빠름
+ts_dict = dict()
+ts_list = list()
+for i in range(0, max_ts_denominator + 1):  # 1 ~ 64
+    for j in range(1, ((2 ** i) * max_notes_per_bar) + 1):
+        ts_dict[(j, 2 ** i)] = len(ts_dict)
+        ts_list.append((j, 2 ** i))
+dur_enc = list()
+dur_dec = list()
+for i in range(duration_max):
+    for j in range(pos_resolution):
+        dur_dec.append(len(dur_enc))
+        for k in range(2 ** i):
+            dur_enc.append(len(dur_dec) - 1)
+
+
+def _signature():
+    stat = os.stat(KEY_PROFILE_PATH)
+    params = (chord_pitch_out_of_key_prob, key_change_prob, chord_change_prob, stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha256(repr(params).encode()).hexdigest()[:12]
+
+
+def _cached(name, build):
+    path = os.path.join(TABLES_DIR, f'{name}-{_signature()}.npy')
+    if os.path.exists(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+    value = np.asarray(build())
+    try:
+        os.makedirs(TABLES_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, value)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # read-only image 등에서는 cache 없이 매번 계산
+        print(f"can not cache table {name}: {e}")
+    return value
+
+
+def _load_key_profile():
+    with open(KEY_PROFILE_PATH, 'rb') as f:
+        return pickle.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def _key_chord_tables():
+    # magenta (absl) 는 table 을 새로 만들어야 할 때만 import
+    from .magenta_chord_recognition import _key_chord_distribution, _key_chord_transition_distribution
+
+    key_chord_distribution = _key_chord_distribution(
+        chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
+    key_chord_transition_distribution = _key_chord_transition_distribution(
+        key_chord_distribution,
+        key_change_prob=key_change_prob,
+        chord_change_prob=chord_change_prob)
+    return np.log(key_chord_distribution), np.log(key_chord_transition_distribution)
+
+
+key_profile = _cached('key_profile', _load_key_profile)
+key_chord_loglik = _cached('key_chord_loglik', lambda: _key_chord_tables()[0])
+key_chord_transition_loglik = _cached('key_chord_transition_loglik', lambda: _key_chord_tables()[1])
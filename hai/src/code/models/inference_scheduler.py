@@ -0,0 +1,272 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+from models.initializing import unwrap_model
+
+
+class _Request(object):
+    def __init__(self, x, tempo, not_empty_pos, condition_pos, skip_step):
+        self.x = x
+        self.tempo = tempo
+        self.not_empty_pos = not_empty_pos
+        self.condition_pos = condition_pos
+        self.skip_step = skip_step
+        self.figure_size = x.size()[-1]
+        self.arrived = time.time()
+        self.future = Future()
+
+
+class MicroBatchScheduler(object):
+    """Collects concurrent `Solver.infer_sample` calls for a short window and runs them as one batch.
+
+    Requests are bucketed by figure size (`bucket_size` time units per bucket) so that padding
+    inside a batch stays small. A single background thread owns the model.
+    """
+
+    def __init__(self, solver, use_ema=True, max_batch_size=4, max_wait=0.05, bucket_size=64):
+        self.solver = solver
+        self.use_ema = use_ema
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bucket_size = bucket_size
+
+        self._buckets = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='micro-batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, x, tempo, not_empty_pos, condition_pos, skip_step=0):
+        # x: (1, 14, figure_size) as returned by track_generation.F
+        assert x.size()[0] == 1
+        request = _Request(x[0], tempo, not_empty_pos, condition_pos, skip_step)
+        key = (request.figure_size // self.bucket_size, skip_step)
+        with self._cond:
+            self._buckets.setdefault(key, []).append(request)
+            self._cond.notify_all()
+        return request.future
+
+    def infer_sample(self, x, tempo, not_empty_pos, condition_pos, skip_step=0):
+        return self.submit(x, tempo, not_empty_pos, condition_pos, skip_step).result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._buckets:
+                    self._cond.wait()
+                    continue
+
+                # 가장 오래 기다린 request 가 있는 bucket 부터 처리
+                key = min(self._buckets, key=lambda k: self._buckets[k][0].arrived)
+                queue = self._buckets[key]
+                deadline = queue[0].arrived + self.max_wait
+                if len(queue) < self.max_batch_size and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                    continue
+
+                batch = queue[:self.max_batch_size]
+                del queue[:self.max_batch_size]
+                if not queue:
+                    del self._buckets[key]
+                return batch
+        return None
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            try:
+                oct_lines = self.solver.infer_batch([r.x for r in batch],
+                                                    [r.tempo for r in batch],
+                                                    [r.not_empty_pos for r in batch],
+                                                    [r.condition_pos for r in batch],
+                                                    use_ema=self.use_ema,
+                                                    skip_step=batch[0].skip_step)
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            for r, oct_line in zip(batch, oct_lines):
+                r.future.set_result(oct_line)
+
+
+class _Generation(object):
+    def __init__(self, request, rfm, device):
+        x = request.x.view(-1).long().to(device)
+        self.request = request
+        self.figure_size = request.figure_size
+        self.x_start = x
+        self.x = x.clone()
+        self.condition_pos = request.condition_pos.reshape(-1).bool().to(device)
+        self.not_empty_pos = request.not_empty_pos.reshape(-1).bool().to(device)
+
+        num_to_be_generated_per_track = (request.x == rfm.num_classes - 1).sum(-1)
+        num_to_be_generated_per_track = num_to_be_generated_per_track[0::2] + num_to_be_generated_per_track[1::2]
+        self.n_sample = rfm.sampling_schedule(num_to_be_generated_per_track.to(device), request.skip_step)
+        self.diffusion_index = rfm.num_timesteps - 1
+        self.sampled = torch.zeros(7, dtype=torch.long, device=device)
+        self.skip_empty_steps()
+
+    def skip_empty_steps(self):
+        # steps where no track has anything left to unmask need no denoiser pass
+        # (this also jumps over the steps left out by skip_step, their schedule rows are -1)
+        while self.diffusion_index > 0 and not (self.sampled < self.n_sample[self.diffusion_index]).any():
+            self.diffusion_index -= 1
+            self.sampled = torch.zeros_like(self.sampled)
+
+
+class ContinuousBatchScheduler(object):
+    """Step-level batching for the diffusion sampler.
+
+    Keeps a pool of active generations. Every iteration runs one denoiser pass over all of them,
+    each at its own diffusion step, admits newly arrived requests and retires finished ones
+    right away instead of waiting for the rest of the batch.
+    """
+
+    def __init__(self, solver, use_ema=True, max_active=8):
+        self.solver = solver
+        self.use_ema = use_ema
+        self.max_active = max_active
+
+        self.model = unwrap_model(solver.model)
+        self.rfm = self.model.rfm
+        self.empty_index = self.rfm.num_classes - 2
+
+        self._pending = deque()
+        self._active = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='continuous-batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, x, tempo, not_empty_pos, condition_pos, skip_step=0):
+        # x: (1, 14, figure_size) as returned by track_generation.F
+        # the future resolves to the sampled (14, figure_size) token ids
+        assert x.size()[0] == 1
+        request = _Request(x[0], tempo, not_empty_pos, condition_pos, skip_step)
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify_all()
+        return request.future
+
+    def infer_sample(self, x, tempo, not_empty_pos, condition_pos, skip_step=0):
+        tokens = self.submit(x, tempo, not_empty_pos, condition_pos, skip_step).result()
+        return self.solver.decode_sample(tokens, tempo)
+
+    def _admit(self):
+        with self._cond:
+            while not self._stopped and not self._pending and not self._active:
+                self._cond.wait()
+            if self._stopped:
+                return False
+            admitted = []
+            while self._pending and len(self._active) + len(admitted) < self.max_active:
+                admitted.append(self._pending.popleft())
+
+        if admitted and not self._active and self.use_ema and self.solver.ema is not None:
+            self.solver.ema.modify_to_inference()
+            self.model.eval()
+
+        device = self.rfm.log_at.device
+        for request in admitted:
+            try:
+                self._active.append(_Generation(request, self.rfm, device))
+            except Exception as e:
+                request.future.set_exception(e)
+        return True
+
+    def _step(self):
+        active = self._active
+        batch_size = len(active)
+        max_len = max(g.figure_size for g in active)
+        device = self.rfm.log_at.device
+
+        x = torch.full((batch_size, 14, max_len), self.empty_index, dtype=torch.long, device=device)
+        condition_pos = torch.zeros(batch_size, 14, max_len, dtype=torch.bool, device=device)
+        not_empty_pos = torch.zeros(batch_size, 14, max_len, dtype=torch.bool, device=device)
+        attention_mask = torch.zeros(batch_size, max_len, device=device)
+        for i, g in enumerate(active):
+            # return condition to ground truth, empty positions stay empty
+            g.x = torch.where(g.condition_pos, g.x_start, g.x)
+            g.x = torch.where(g.not_empty_pos, g.x, torch.full_like(g.x, self.empty_index))
+            x[i, :, :g.figure_size] = g.x.view(14, -1)
+            condition_pos[i, :, :g.figure_size] = g.condition_pos.view(14, -1)
+            not_empty_pos[i, :, :g.figure_size] = g.not_empty_pos.view(14, -1)
+            attention_mask[i, :g.figure_size] = 1
+
+        t = torch.tensor([g.diffusion_index for g in active], device=device, dtype=torch.long)
+        sampled = torch.stack([g.sampled for g in active], dim=0)
+        to_sample = torch.stack([g.n_sample[g.diffusion_index] for g in active], dim=0)
+
+        # token id 그대로 p_sample (vocabulary 크기의 one-hot 을 만들지 않음)
+        with torch.no_grad():
+            out, sampled = self.rfm.p_sample_index(x.view(batch_size, -1), t, max_len,
+                                                   condition_pos.view(batch_size, -1).float(),
+                                                   not_empty_pos.view(batch_size, -1).float(),
+                                                   sampled, to_sample, attention_mask=attention_mask)
+        out = out.view(batch_size, 14, max_len)
+
+        still_active = []
+        for i, g in enumerate(active):
+            g.x = out[i, :, :g.figure_size].reshape(-1)
+            if g.diffusion_index == 0:
+                self._retire(g)
+                continue
+            g.sampled = sampled[i]
+            g.skip_empty_steps()
+            still_active.append(g)
+        self._active = still_active
+
+        if not self._active and self.use_ema and self.solver.ema is not None:
+            self.solver.ema.modify_to_train()
+
+    def _retire(self, g):
+        tokens = torch.where(g.condition_pos, g.x_start, g.x)
+        tokens = torch.where(g.not_empty_pos, tokens, torch.full_like(tokens, self.rfm.pad_index))
+        g.request.future.set_result(tokens.view(14, -1).cpu())
+
+    def _run(self):
+        while self._admit():
+            try:
+                self._step()
+            except Exception as e:
+                for g in self._active:
+                    g.request.future.set_exception(e)
+                self._active = []
+                if self.use_ema and self.solver.ema is not None:
+                    self.solver.ema.modify_to_train()
@@ -17,7 +17,35 @@ from models.getmusic.engine.solver import Solver
 from models.getmusic.modeling.build import build_model
 
 from models.schemas import GetMusicInput, GetMusicOutput
-from utils.utils import load_yaml_config, load_json_params, download_from_s3, upload_to_s3
+from utils.utils import load_yaml_config, load_json_params, download_from_s3
+
+def configure_device(name: str = 'auto'):
+    # 'auto' 는 GPU 가 있으면 cuda:0, 없으면 cpu
+    if name == 'auto':
+        name = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(name)
+
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+    else:
+        # CPU 에서는 이 process 가 쓸 수 있는 core 를 모두 intra-op 에 쓰고,
+        # 동시에 도는 stage thread 들과 겹치지 않도록 inter-op thread 는 적게 둠
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        torch.set_num_threads(int(os.environ.get('HAI_TORCH_THREADS', cores)))
+        try:
+            torch.set_num_interop_threads(int(os.environ.get('HAI_TORCH_INTEROP_THREADS', 2)))
+        except RuntimeError:
+            # inter-op pool 이 이미 시작된 경우 (process 에서 한 번만 설정 가능)
+            pass
+
+    print(f"device: {device}, intra-op threads: {torch.get_num_threads()}, inter-op threads: {torch.get_num_interop_threads()}")
+    return device
+
+def unwrap_model(model):
+    # DistributedDataParallel 로 감싼 경우 실제 model 을 반환
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        return model.module
+    return model
 
 # Load parameters
 def load_parameters():
@@ -41,8 +69,7 @@ def load_parameters():
     args.save_dir = os.path.join(args.output, args.name, now)
 
     seed_everything(args.seed, args.cudnn_deterministic)
-    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-    torch.cuda.set_device(device)
+    args.device = configure_device(os.environ.get('HAI_DEVICE', getattr(args, 'device', 'auto')))
     args.local_rank = 0
     args.ngpus_per_node = args.world_size = args.local_rank = args.node_rank = 1
     args.global_rank = args.local_rank + args.node_rank * args.ngpus_per_node
@@ -1,12 +1,23 @@
 import asyncio
 
+import numpy as np
 from basic_pitch.inference import predict, predict_and_save, Model
-from basic_pitch import ICASSP_2022_MODEL_PATH
+from basic_pitch import ICASSP_2022_MODEL_PATH, note_creation
+from basic_pitch.constants import AUDIO_SAMPLE_RATE, AUDIO_N_SAMPLES, ANNOTATIONS_FPS, FFT_HOP
 from typing import List
 
+from models.transcription_engine import TranscriptionEngine
+
+# basic_pitch.inference.run_inference 와 같은 window 설정
+N_OVERLAPPING_FRAMES = 30
+OVERLAP_LEN = N_OVERLAPPING_FRAMES * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
+
 class Mp3ToMIDIModel:
-    def __init__(self):
+    def __init__(self, num_workers=2, max_batch_size=8):
         self.model = Model(model_path = ICASSP_2022_MODEL_PATH)
+        # window 단위로 병렬 / 여러 request 의 window 를 묶어서 batch 추론
+        self.engine = TranscriptionEngine(self.model, num_workers=num_workers, max_batch_size=max_batch_size)
     
     def pred(self, audio_path: str, tempo: int):
         model_output, midi_data, note_events = predict(
@@ -19,6 +30,83 @@ class Mp3ToMIDIModel:
         )
 
         return model_output, midi_data, note_events
+
+    def run_inference(self, audio: np.ndarray, on_progress=None, on_window=None):
+        # basic-pitch 의 run_inference 를 파일 대신 이미 decode 된 buffer (AUDIO_SAMPLE_RATE, mono) 로 수행
+        # window 끼리 겹치는 부분은 잘라낸 뒤 이어 붙이고, note 는 이어 붙인 전체 posteriorgram 에서 만들기 때문에
+        # window 경계에서 note 가 끊기지 않음
+        # on_window(i, total, output) 에는 겹치는 부분을 잘라낸 window i 의 posteriorgram 이 끝나는 대로 순서대로 전달
+        original_length = audio.shape[0]
+        audio = np.concatenate([np.zeros((OVERLAP_LEN // 2,), dtype=np.float32), audio.astype(np.float32)])
+
+        windows = []
+        for i in range(0, audio.shape[0], HOP_SIZE):
+            window = audio[i:i + AUDIO_N_SAMPLES]
+            if len(window) < AUDIO_N_SAMPLES:
+                window = np.pad(window, (0, AUDIO_N_SAMPLES - len(window)))
+            windows.append(window)
+
+        n_olap = N_OVERLAPPING_FRAMES // 2
+        n_frames = int(np.floor(original_length * (ANNOTATIONS_FPS / AUDIO_SAMPLE_RATE)))
+
+        def on_output(i, window_output):
+            if on_window is None:
+                return
+            trimmed = {k: v[0, n_olap:-n_olap, :] for k, v in window_output.items()}
+            frames_per_window = next(iter(trimmed.values())).shape[0]
+            remaining = n_frames - i * frames_per_window
+            on_window(i, len(windows), {k: v[:max(remaining, 0)] for k, v in trimmed.items()})
+
+        output = {"note": [], "onset": [], "contour": []}
+        for window_output in self.engine.predict(windows, on_progress=on_progress, on_output=on_output):
+            for k, v in window_output.items():
+                output[k].append(v)
+
+        unwrapped = {}
+        for k, v in output.items():
+            v = np.concatenate(v)[:, n_olap:-n_olap, :]
+            unwrapped[k] = v.reshape(v.shape[0] * v.shape[1], v.shape[2])[:n_frames, :]
+        return unwrapped
+
+    def _notes(self, model_output, tempo):
+        # pred 와 같은 threshold
+        min_note_len = int(np.round(150 / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+        return note_creation.model_output_to_notes(
+            model_output,
+            onset_thresh=0.7,
+            frame_thresh=0.5,
+            min_note_len=min_note_len,
+            min_freq=None,
+            max_freq=None,
+            multiple_pitch_bends=False,
+            melodia_trick=True,
+            midi_tempo=tempo,
+        )
+
+    def pred_audio(self, audio: np.ndarray, tempo: int, on_progress=None, on_notes=None):
+        # audio 는 AUDIO_SAMPLE_RATE(22050) mono float32
+        # on_notes(done, total, note_events) 로 window 가 끝날 때마다 그때까지의 note 를 미리 전달
+        # (window 하나씩 따로 뽑은 것이라 경계에 걸친 note 는 나뉠 수 있음, 최종 결과는 전체 posteriorgram 에서 다시 뽑음)
+        on_window = None
+        if on_notes is not None:
+            partial = []
+
+            def on_window(i, total, window_output):
+                if len(window_output['note']) > 0:
+                    offset = i * HOP_SIZE / AUDIO_SAMPLE_RATE
+                    _, note_events = self._notes(window_output, tempo)
+                    partial.extend((start + offset, end + offset, pitch, amplitude, bends)
+                                   for start, end, pitch, amplitude, bends in note_events)
+                on_notes(i + 1, total, list(partial))
+
+        model_output = self.run_inference(audio, on_progress=on_progress, on_window=on_window)
+        midi_data, note_events = self._notes(model_output, tempo)
+
+        return model_output, midi_data, note_events
+
+    def notes_to_midi(self, note_events, tempo):
+        # note_events 는 초 단위라 tempo 와 무관 -> 나중에 정해진 tempo 로 midi 를 다시 만들 수 있음
+        return note_creation.note_events_to_midi(note_events, midi_tempo=tempo, multiple_pitch_bends=False)
     
     def pred_and_save(self, audio_path: str, output_directory: str, parameters: List[float]=None):
         predict_and_save(
@@ -16,8 +16,10 @@ import pickle
 import miditoolkit
 import math
 from getmusic.utils.midi_config import *
-from getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _key_chord_distribution,\
-    _key_chord_transition_distribution, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+from getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+# ts / duration / key-chord table 은 한 번 만들어 .npy 로 cache 한 것을 mmap 으로 읽음
+from getmusic.utils.tables import ts_dict, ts_list, dur_enc, dur_dec, key_profile, pos_in_bar, \
+    key_chord_loglik, key_chord_transition_loglik
 
 NODE_RANK = os.environ['INDEX'] if 'INDEX' in os.environ else 0
 NODE_RANK = int(NODE_RANK)
@@ -46,43 +48,12 @@ _CHORD_KIND_PITCHES = {
     'm7b5': [0, 3, 6, 10],
 }
 
-ts_dict = dict()
-ts_list = list()
-for i in range(0, max_ts_denominator + 1):  # 1 ~ 64
-    for j in range(1, ((2 ** i) * max_notes_per_bar) + 1):
-        ts_dict[(j, 2 ** i)] = len(ts_dict)
-        ts_list.append((j, 2 ** i))
-dur_enc = list()
-dur_dec = list()
-for i in range(duration_max):
-    for j in range(pos_resolution):
-        dur_dec.append(len(dur_enc))
-        for k in range(2 ** i):
-            dur_enc.append(len(dur_dec) - 1)
-
 tokens_to_ids = {}
 ids_to_tokens = []
 pad_index = None
 empty_index = None
 
 
-key_profile = pickle.load(open('getmusic/utils/key_profile.pickle', 'rb'))
-
-pos_in_bar = beat_note_factor * max_notes_per_bar * pos_resolution
-
-
-chord_pitch_out_of_key_prob = 0.01
-key_change_prob = 0.001
-chord_change_prob = 0.5
-key_chord_distribution = _key_chord_distribution(
-    chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-key_chord_loglik = np.log(key_chord_distribution)
-key_chord_transition_distribution = _key_chord_transition_distribution(
-    key_chord_distribution,
-    key_change_prob=key_change_prob,
-    chord_change_prob=chord_change_prob)
-key_chord_transition_loglik = np.log(key_chord_transition_distribution)
-
 class Item(object):
     def __init__(self, name, start, end, vel=0, pitch=0, track=0, value=''):
         self.name = name
@@ -17,14 +17,14 @@ import numpy as np
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2]))
 from getmusic.utils.midi_config import *
 import pickle
-from getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _key_chord_distribution,\
-    _key_chord_transition_distribution, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+from getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+# ts / duration / key-chord table 은 한 번 만들어 .npy 로 cache 한 것을 mmap 으로 읽음
+from getmusic.utils.tables import ts_dict, ts_list, dur_enc, dur_dec, key_profile, pos_in_bar, \
+    key_chord_loglik, key_chord_transition_loglik
 
-pos_in_bar = beat_note_factor * max_notes_per_bar * pos_resolution
 data_zip = None
 output_file = None
 
-key_profile = pickle.load(open('getmusic/utils/key_profile.pickle', 'rb'))
 
 lock_file = Lock()
 lock_write = Lock()
@@ -40,32 +40,6 @@ midi_dict = manager.dict()
 root_dict = {'C': 0, 'C#': 1, 'D': 2, 'Eb': 3, 'E': 4, 'F': 5, 'F#': 6, 'G': 7, 'Ab': 8, 'A': 9, 'Bb': 10, 'B': 11}
 kind_dict = {'null': 0, 'm': 1, '+': 2, 'dim': 3, 'seven': 4, 'maj7': 5, 'm7': 6, 'm7b5': 7}
 
-ts_dict = dict()
-ts_list = list()
-for i in range(0, max_ts_denominator + 1):  # 1 ~ 64
-    for j in range(1, ((2 ** i) * max_notes_per_bar) + 1):
-        ts_dict[(j, 2 ** i)] = len(ts_dict)
-        ts_list.append((j, 2 ** i))
-dur_enc = list()
-dur_dec = list()
-for i in range(duration_max):
-    for j in range(pos_resolution):
-        dur_dec.append(len(dur_enc))
-        for k in range(2 ** i):
-            dur_enc.append(len(dur_dec) - 1)
-
-chord_pitch_out_of_key_prob = 0.01
-key_change_prob = 0.001
-chord_change_prob = 0.5
-key_chord_distribution = _key_chord_distribution(
-    chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-key_chord_loglik = np.log(key_chord_distribution)
-key_chord_transition_distribution = _key_chord_transition_distribution(
-    key_chord_distribution,
-    key_change_prob=key_change_prob,
-    chord_change_prob=chord_change_prob)
-key_chord_transition_loglik = np.log(key_chord_transition_distribution)
-
 
 class timeout:
     def __init__(self, seconds=1, error_message='Timeout'):
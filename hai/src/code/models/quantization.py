@@ -0,0 +1,169 @@
+import os
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+
+from models.initializing import unwrap_model
+
+
+def quantize_dynamic_int8(denoiser):
+    # encoder 의 q/k/v/dense, embeddings_project, outputs_project, lm_head 등 nn.Linear 만 int8 로 (activation 은 실행 시 quantize)
+    return torch.ao.quantization.quantize_dynamic(denoiser, {nn.Linear}, dtype=torch.qint8)
+
+
+def _export_identity(solver, checkpoint_path):
+    # export 가 어떤 checkpoint (와 EMA 적용 여부) 로 만들어졌는지
+    from utils.result_cache import checkpoint_identity
+    return {'checkpoint': checkpoint_identity(checkpoint_path), 'ema': solver.ema is not None}
+
+
+def _load_export(path, identity):
+    if not os.path.exists(path):
+        return None
+    try:
+        export = torch.load(path, map_location='cpu', weights_only=False)
+    except Exception as e:
+        print(f"can not read int8 denoiser from {path}: {e}")
+        return None
+    if not isinstance(export, dict) or export.get('identity') != identity:
+        print(f"int8 denoiser at {path} was exported from another checkpoint, quantizing again")
+        return None
+    return export['module']
+
+
+def _save_export(path, identity, quantized):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.save({'identity': identity, 'module': quantized}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def quantize_denoiser(solver, path=None, checkpoint_path=None):
+    """Swaps the RoFormer denoiser of `solver` for an int8 dynamically quantized copy (CPU only).
+
+    The EMA weights, if any, are baked in first and EMA swapping is turned off, because the
+    quantized module can not load the fp32 state dicts EMA keeps. When `path` is given, the
+    quantized module is exported there together with the identity of `checkpoint_path`, and
+    loaded from there (without quantizing again) as long as that identity still matches, so the
+    served weights are exactly the ones `python -m models.quantization` validated and never the
+    ones of an older checkpoint. Returns the original fp32 denoiser.
+    """
+    model = unwrap_model(solver.model)
+    rfm = model.rfm
+    assert rfm.device().type == 'cpu', "dynamic int8 quantization only runs on cpu"
+
+    identity = _export_identity(solver, checkpoint_path)
+    if solver.ema is not None:
+        solver.ema.modify_to_inference()
+        solver.ema = None
+    model.eval()
+
+    reference = rfm.roformer
+    quantized = _load_export(path, identity) if path is not None else None
+    if quantized is not None:
+        print(f"loaded int8 denoiser from {path}")
+    else:
+        quantized = quantize_dynamic_int8(reference)
+        if path is not None:
+            _save_export(path, identity, quantized)
+            print(f"exported int8 denoiser to {path}")
+    quantized.eval()
+    rfm.roformer = quantized
+    return reference
+
+
+@torch.no_grad()
+def measure_agreement(rfm, reference, candidate, samples, seed=0):
+    # samples: F 가 만든 (x, not_empty_pos, condition_pos) 의 list
+    # - denoiser agreement: 첫 step (전부 mask) 에서 생성할 위치의 argmax 가 같은 비율
+    # - token agreement: 같은 seed 로 전체 sampling 했을 때 생성된 token 이 같은 비율
+    current = rfm.roformer
+    totals = {'positions': 0, 'denoiser_match': 0, 'token_match': 0, 'reference_seconds': 0.0, 'candidate_seconds': 0.0}
+    try:
+        for i, (x, not_empty_pos, condition_pos) in enumerate(samples):
+            x = x.view(1, 14, -1).long()
+            not_empty_pos = not_empty_pos.view(1, 14, -1).float()
+            condition_pos = condition_pos.view(1, 14, -1).float()
+            generated = (x.view(1, -1) == rfm.num_classes - 1) & not_empty_pos.view(1, -1).bool()
+
+            t = torch.full((1,), rfm.num_timesteps - 1, dtype=torch.long)
+            ref_top1 = reference(x.view(1, -1), t, condition_pos.view(1, -1)).argmax(-1)
+            cand_top1 = candidate(x.view(1, -1), t, condition_pos.view(1, -1)).argmax(-1)
+
+            tokens = {}
+            for name, denoiser in (('reference', reference), ('candidate', candidate)):
+                rfm.roformer = denoiser
+                torch.manual_seed(seed)
+                start = time.time()
+                tokens[name] = rfm.sample(x, None, not_empty_pos, condition_pos).view(1, -1)
+                totals[f'{name}_seconds'] += time.time() - start
+
+            n = int(generated.sum())
+            denoiser_match = int((ref_top1 == cand_top1)[generated].sum())
+            token_match = int((tokens['reference'] == tokens['candidate'])[generated].sum())
+            totals['positions'] += n
+            totals['denoiser_match'] += denoiser_match
+            totals['token_match'] += token_match
+            print(f"sample {i}: {n} positions, denoiser agreement {denoiser_match / max(n, 1):.4f}, "
+                  f"token agreement {token_match / max(n, 1):.4f}")
+    finally:
+        rfm.roformer = current
+
+    n = max(totals['positions'], 1)
+    return {
+        'positions': totals['positions'],
+        'denoiser_agreement': totals['denoiser_match'] / n,
+        'token_agreement': totals['token_match'] / n,
+        'reference_seconds': totals['reference_seconds'],
+        'candidate_seconds': totals['candidate_seconds'],
+        'speedup': totals['reference_seconds'] / max(totals['candidate_seconds'], 1e-9),
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='export the int8 denoiser and compare it with fp32')
+    parser.add_argument('--midi', type=str, nargs='+', required=True,
+                        help='midi files used as conditions')
+    parser.add_argument('--instrument', type=str, default='p',
+                        help='conditional track of the request (same letters as the api)')
+    parser.add_argument('--content', type=str, default='bd',
+                        help='tracks to generate')
+    parser.add_argument('--export', type=str, default=os.environ.get('HAI_QUANTIZED_PATH'),
+                        help='where the int8 denoiser is written')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    from models.initializing import initialize
+    from models.track_generation import F, encode_midi, parse_condition, parse_content
+
+    opt = get_args()
+    os.environ.setdefault('HAI_DEVICE', 'cpu')
+    args, Logger, solver, tokens_to_ids, ids_to_tokens, pad_index, empty_index = initialize()
+
+    conditional_track, condition_inst = parse_condition(opt.instrument)
+    content_track = parse_content(opt.content)
+    samples = []
+    for path in opt.midi:
+        with open(path, 'rb') as f:
+            midi_bytes = f.read()
+        encoded = encode_midi(midi_bytes, bool(conditional_track[-1]), condition_inst, args.chord_from_single)
+        x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc, have_cond = F(midi_bytes, conditional_track, content_track,
+                                                                                condition_inst, args.chord_from_single, tokens_to_ids,
+                                                                                ids_to_tokens, empty_index, pad_index, encoded=encoded)
+        samples.append((x, not_empty_pos, condition_pos))
+
+    if opt.export is not None and os.path.exists(opt.export):
+        # 기존 export 가 아니라 지금 checkpoint 로 다시 만들어서 비교
+        os.remove(opt.export)
+    reference = quantize_denoiser(solver, path=opt.export, checkpoint_path=args.load_path)
+    rfm = unwrap_model(solver.model).rfm
+    result = measure_agreement(rfm, reference, rfm.roformer, samples, seed=opt.seed)
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ class GenerationInput(BaseModel):
     user: str
     instrument: str
     content_name: str
+    # sampling 품질 / 속도 tier (router.QUALITY_TIERS)
+    quality: str = 'high'
 
 
 # BasicPitch
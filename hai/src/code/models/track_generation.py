@@ -1,5 +1,6 @@
 import argparse
 import os
+import io
 import warnings
 import time
 import torch
@@ -17,8 +18,10 @@ import pickle
 import miditoolkit
 import math
 from models.getmusic.utils.midi_config import *
-from models.getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _key_chord_distribution,\
-    _key_chord_transition_distribution, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+from models.getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+# ts / duration / key-chord table 은 한 번 만들어 .npy 로 cache 한 것을 mmap 으로 읽음
+from models.getmusic.utils.tables import ts_dict, ts_list, dur_enc, dur_dec, key_profile, pos_in_bar, \
+    key_chord_loglik, key_chord_transition_loglik
 
 NODE_RANK = os.environ['INDEX'] if 'INDEX' in os.environ else 0
 NODE_RANK = int(NODE_RANK)
@@ -47,43 +50,11 @@ _CHORD_KIND_PITCHES = {
     'm7b5': [0, 3, 6, 10],
 }
 
-ts_dict = dict()
-ts_list = list()
-for i in range(0, max_ts_denominator + 1):  # 1 ~ 64
-    for j in range(1, ((2 ** i) * max_notes_per_bar) + 1):
-        ts_dict[(j, 2 ** i)] = len(ts_dict)
-        ts_list.append((j, 2 ** i))
-dur_enc = list()
-dur_dec = list()
-for i in range(duration_max):
-    for j in range(pos_resolution):
-        dur_dec.append(len(dur_enc))
-        for k in range(2 ** i):
-            dur_enc.append(len(dur_dec) - 1)
-
 tokens_to_ids = {}
 ids_to_tokens = []
 pad_index = None
 empty_index = None
 
-current_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(current_dir, 'getmusic/utils/key_profile.pickle')
-key_profile = pickle.load(open(file_path, 'rb'))
-
-pos_in_bar = beat_note_factor * max_notes_per_bar * pos_resolution
-
-
-chord_pitch_out_of_key_prob = 0.01
-key_change_prob = 0.001
-chord_change_prob = 0.5
-key_chord_distribution = _key_chord_distribution(
-    chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-key_chord_loglik = np.log(key_chord_distribution)
-key_chord_transition_distribution = _key_chord_transition_distribution(
-    key_chord_distribution,
-    key_change_prob=key_change_prob,
-    chord_change_prob=chord_change_prob)
-key_chord_transition_loglik = np.log(key_chord_transition_distribution)
 
 class Item(object):
     def __init__(self, name, start, end, vel=0, pitch=0, track=0, value=''):
@@ -259,12 +230,28 @@ def time_signature_reduce(numerator, denominator):
     return numerator, denominator
 
 def MIDI_to_encoding(midi_obj, with_chord, condition_inst, chord_from_single):
-    i = 0
-
     def time_to_pos(t):
         return round(t * pos_resolution / midi_obj.ticks_per_beat)
-    notes_start_pos = [time_to_pos(j.start)
-                       for i in midi_obj.instruments for j in i.notes]
+
+    notes = [(note.start, note.end, inst.program, inst.is_drum, note.pitch, note.velocity)
+             for inst in midi_obj.instruments for note in inst.notes]
+    return notes_to_encoding(notes, midi_obj.time_signature_changes, midi_obj.tempo_changes, time_to_pos,
+                             with_chord, condition_inst, chord_from_single)
+
+def note_events_to_encoding(note_events, tempo, program, with_chord, condition_inst, chord_from_single, melody_split=59):
+    # basic-pitch note_events (초 단위) -> MIDI_to_encoding 과 같은 encoding. 중간 MIDI 객체를 만들지 않음
+    # separate_melody 와 같이 melody_split 보다 높은 음은 멜로디로 보고 반주(condition)에서 제외
+    def time_to_pos(t):
+        return round(t * tempo / 60 * pos_resolution)
+
+    notes = [(e[0], e[1], program, False, int(e[2]), int(round(127 * e[3])))
+             for e in note_events if e[2] <= melody_split]
+    tpc = [miditoolkit.midi.containers.TempoChange(float(tempo), 0)]
+    return notes_to_encoding(notes, [], tpc, time_to_pos, with_chord, condition_inst, chord_from_single)
+
+def notes_to_encoding(notes, tsc, tpc, time_to_pos, with_chord, condition_inst, chord_from_single):
+    # notes: (start, end, program, is_drum, pitch, velocity), start/end 는 time_to_pos 의 입력 단위
+    notes_start_pos = [time_to_pos(n[0]) for n in notes]
   
     if len(notes_start_pos) == 0:
         return list()
@@ -273,8 +260,6 @@ def MIDI_to_encoding(midi_obj, with_chord, condition_inst, chord_from_single):
 
     pos_to_info = [[None for _ in range(4)] for _ in range(
         max_pos)] 
-    tsc = midi_obj.time_signature_changes 
-    tpc = midi_obj.tempo_changes
 
     for i in range(len(tsc)):
         for j in range(time_to_pos(tsc[i].time), time_to_pos(tsc[i + 1].time) if i < len(tsc) - 1 else max_pos):
@@ -308,15 +293,14 @@ def MIDI_to_encoding(midi_obj, with_chord, condition_inst, chord_from_single):
             bar += 1
     encoding = []
             
-    for inst in midi_obj.instruments:
-        for note in inst.notes:
-            if time_to_pos(note.start) >= trunc_pos:
-                continue
+    for start, end, program, is_drum, pitch, velocity in notes:
+        if time_to_pos(start) >= trunc_pos:
+            continue
 
-            info = pos_to_info[time_to_pos(note.start)]
-            duration = d2e(time_to_pos(note.end) - time_to_pos(note.start))
-            encoding.append([info[0], info[2], max_inst + 1 if inst.is_drum else inst.program, note.pitch + max_pitch +
-                            1 if inst.is_drum else note.pitch, duration, v2e(note.velocity), info[1], info[3]])
+        info = pos_to_info[time_to_pos(start)]
+        duration = d2e(time_to_pos(end) - time_to_pos(start))
+        encoding.append([info[0], info[2], max_inst + 1 if is_drum else program, pitch + max_pitch +
+                        1 if is_drum else pitch, duration, v2e(velocity), info[1], info[3]])
     if len(encoding) == 0:
         return list()
 
@@ -467,7 +451,32 @@ def encoding_to_MIDI(encoding, tpc, decode_chord):
 
     return midi_obj
 
-def F(file_name, conditional_tracks, content_tracks, condition_inst, chord_from_single, tokens_to_ids, ids_to_tokens, empty_index, pad_index):
+def load_midi(midi):
+    # path, .mid bytes 또는 이미 읽은 miditoolkit 객체
+    if isinstance(midi, miditoolkit.midi.parser.MidiFile):
+        return midi
+    if isinstance(midi, (bytes, bytearray)):
+        return miditoolkit.midi.parser.MidiFile(file=io.BytesIO(midi))
+    return miditoolkit.midi.parser.MidiFile(midi)
+
+# 사용자가 고른 instrument -> encoding 에서 쓰는 program 번호 (inst_to_row 의 key)
+instrument_to_program = {'p': 0, 'g': 25, 'b': 32, 'l': 80}
+
+def encode_note_events(note_events, tempo, instrument, with_chord, condition_inst, chord_from_single):
+    # encode_midi 와 같은 형태로 반환
+    program = instrument_to_program[instrument]
+    encoding, pitch_shift, tpc = note_events_to_encoding(note_events, tempo, program, with_chord, condition_inst, chord_from_single)
+    return encoding, pitch_shift, tpc, float(tempo)
+
+def encode_midi(midi, with_chord, condition_inst, chord_from_single):
+    # F 의 앞부분 (midi -> octuple encoding). instrument 와 무관하게 content track 만 바뀌는 요청끼리 재사용 가능
+    midi_obj = load_midi(midi)
+    encoding, pitch_shift, tpc = MIDI_to_encoding(midi_obj, with_chord, condition_inst, chord_from_single)
+    return encoding, pitch_shift, tpc, midi_obj.tempo_changes[0].tempo
+
+def F(file_name, conditional_tracks, content_tracks, condition_inst, chord_from_single, tokens_to_ids, ids_to_tokens, empty_index, pad_index, encoded=None):
+    # file_name: midi path, .mid bytes or a miditoolkit.MidiFile
+    # encoded: encode_midi(...) 결과가 이미 있으면 midi 를 다시 읽지 않음
     
     # global tokens_to_ids
     # global ids_to_tokens
@@ -482,18 +491,18 @@ def F(file_name, conditional_tracks, content_tracks, condition_inst, chord_from_
     empty_tracks = torch.tensor(empty_tracks).float()
     empty_tracks = empty_tracks.view(7,1).repeat(1,2).reshape(14,1)
 
-    midi_obj = miditoolkit.midi.parser.MidiFile(file_name)
-
     if conditional_tracks[-1]:
         with_chord = True
     else:
         with_chord = False
 
     # try:
-    encoding, pitch_shift, tpc = MIDI_to_encoding(midi_obj, with_chord, condition_inst, chord_from_single)
+    if encoded is None:
+        encoded = encode_midi(file_name, with_chord, condition_inst, chord_from_single)
+    encoding, pitch_shift, tpc, first_tempo = encoded
 
     if len(encoding) == 0:
-        print('ERROR(BLANK): ' + file_name + '\n', end='')
+        print('ERROR(BLANK): ' + (file_name if isinstance(file_name, str) else 'in-memory midi') + '\n', end='')
         return None, 0
 
     bar_index_offset = 0
@@ -512,7 +521,7 @@ def F(file_name, conditional_tracks, content_tracks, condition_inst, chord_from_
     
     # tempo = b2e(67)
 
-    tempo = b2e(midi_obj.tempo_changes[0].tempo)
+    tempo = b2e(first_tempo)
 
     lead_start = 0
     idx = 0
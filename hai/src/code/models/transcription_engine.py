@@ -0,0 +1,100 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Window(object):
+    def __init__(self, audio):
+        self.audio = audio
+        self.arrived = time.time()
+        self.future = Future()
+
+
+class TranscriptionEngine(object):
+    """Runs basic-pitch windows on a pool of worker threads, batching windows across requests.
+
+    Every request splits its audio into overlapping windows (see `Mp3ToMIDIModel.run_inference`)
+    and submits them all at once. Workers take up to `max_batch_size` pending windows, no matter
+    which request they belong to, and run them as one `model.predict` call, so a long song is
+    spread over all workers and short songs arriving together share batches.
+    """
+
+    def __init__(self, model, num_workers=2, max_batch_size=8, max_wait=0.01):
+        self.model = model
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopped = False
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name='transcription-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, windows):
+        # windows: (AUDIO_N_SAMPLES,) float32 array 의 list -> 같은 순서의 future list
+        self.start()
+        requests = [_Window(w) for w in windows]
+        with self._cond:
+            self._queue.extend(requests)
+            self._cond.notify_all()
+        return [r.future for r in requests]
+
+    def predict(self, windows, on_progress=None, on_output=None):
+        # on_output(i, output) 은 앞 window 부터 순서대로, 끝나는 대로 호출
+        futures = self.submit(windows)
+        outputs = []
+        for i, future in enumerate(futures):
+            outputs.append(future.result())
+            if on_output is not None:
+                on_output(i, outputs[-1])
+            if on_progress is not None:
+                on_progress(i + 1, len(futures))
+        return outputs
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                deadline = self._queue[0].arrived + self.max_wait
+                if len(self._queue) < self.max_batch_size and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                    continue
+                return [self._queue.popleft() for _ in range(min(self.max_batch_size, len(self._queue)))]
+        return None
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                x = np.stack([w.audio for w in batch])[:, :, np.newaxis]
+                output = self.model.predict(x)
+            except Exception as e:
+                for w in batch:
+                    w.future.set_exception(e)
+                continue
+            for i, w in enumerate(batch):
+                w.future.set_result({k: v[i:i + 1] for k, v in output.items()})
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(CODE_DIR, '../../..', 'configs', 'config.json')
+
+# bin/app.py 처럼 code directory 를 기준으로 import (from utils.utils import ...)
+if CODE_DIR not in sys.path:
+    sys.path.insert(0, CODE_DIR)
+
+
+def require_config():
+    # utils.utils 는 import 시 configs/config.json (S3 설정) 을 읽음
+    if not os.path.exists(CONFIG_PATH):
+        pytest.skip("configs/config.json is required to import utils.utils")
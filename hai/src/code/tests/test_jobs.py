@@ -0,0 +1,55 @@
+import time
+import sqlite3
+
+from utils.jobs import JobStore, JobWorkerPool, DONE
+
+
+def test_partial_is_visible_until_the_job_finishes(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job_id = store.submit({'user': 'u'})
+    store.claim()
+
+    store.set_partial(job_id, {'notes': [[0.0, 0.5, 60, 0.8]], 'windows': 1, 'total_windows': 3})
+    assert store.get(job_id)['partial']['notes'] == [[0.0, 0.5, 60, 0.8]]
+
+    store.finish(job_id, {'url': 'a', 'url2': 'b'})
+    job = store.get(job_id)
+    assert job['state'] == DONE
+    assert job['partial'] is None
+
+
+def test_partial_column_is_added_to_old_db(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, state TEXT NOT NULL, stage TEXT, payload TEXT NOT NULL, '
+                 'result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+    conn.commit()
+    conn.close()
+
+    store = JobStore(path)
+    job_id = store.submit({})
+    assert store.get(job_id)['partial'] is None
+
+
+def test_handler_can_publish_partial_results(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    seen = []
+
+    def handler(payload, set_stage, set_partial):
+        set_stage('notes 1/2')
+        set_partial({'windows': 1})
+        seen.append(store.get(job_id)['partial'])
+        return {'ok': True}
+
+    job_id = store.submit({})
+    pool = JobWorkerPool(store, handler, poll_interval=0.05)
+    pool.start()
+    try:
+        deadline = time.time() + 5
+        while store.get(job_id)['state'] != DONE and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        pool.stop(timeout=1)
+
+    assert seen == [{'windows': 1}]
+    assert store.get(job_id)['result'] == {'ok': True}
@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+mido = pytest.importorskip('mido')
+
+from conftest import require_config
+
+A_MINOR = [57, 59, 60, 62, 64, 65, 67]  # A B C D E F G
+E_FLAT_MAJOR = [63, 65, 67, 68, 70, 72, 74]  # Eb F G Ab Bb C D
+
+
+@pytest.fixture(scope='module')
+def utils():
+    require_config()
+    from utils import utils
+    return utils
+
+
+@pytest.fixture(scope='module')
+def key_profile():
+    from models.getmusic.utils.tables import key_profile
+    return key_profile
+
+
+def scale_events(pitches, tonic_duration=2.0):
+    # basic-pitch 형식 (start_s, end_s, pitch, amplitude, pitch_bends), tonic 을 길게
+    events = []
+    start = 0.0
+    for i, pitch in enumerate(pitches):
+        duration = tonic_duration if i == 0 else 0.5
+        events.append((start, start + duration, pitch, 0.8, None))
+        start += duration
+    return events
+
+
+def test_relative_minor_is_estimated(utils, key_profile):
+    assert utils.estimate_key_from_notes(scale_events(A_MINOR), key_profile) == 'Am'
+
+
+def test_relative_major_is_estimated(utils, key_profile):
+    c_major = [60, 62, 64, 65, 67, 69, 71]
+    assert utils.estimate_key_from_notes(scale_events(c_major), key_profile) == 'C'
+
+
+def test_flat_major_uses_mido_name(utils, key_profile):
+    key = utils.estimate_key_from_notes(scale_events(E_FLAT_MAJOR), key_profile)
+    assert key == 'Eb'
+    mid = mido.MidiFile()
+    mid.tracks.append(mido.MidiTrack())
+    utils.change_key_signature(mid, key)
+    assert any(m.type == 'key_signature' and m.key == 'Eb' for m in mid.tracks[0])
+
+
+def test_key_names_are_valid_for_mido(utils):
+    for key in utils.MAJOR_KEY_NAMES + utils.MINOR_KEY_NAMES:
+        mido.MetaMessage('key_signature', key=key)
+
+
+def test_no_notes(utils, key_profile):
+    assert utils.estimate_key_from_notes([], key_profile) is None
@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+mido = pytest.importorskip('mido')
+
+from utils.score import ingest_score, mxl_to_midi_bytes, note_track_indices
+
+
+def _track(*messages):
+    track = mido.MidiTrack()
+    track.extend(messages)
+    return track
+
+
+def test_conductor_track_is_not_a_part():
+    # music21 streamToMidiFile 과 같은 배치: conductor, melody, accompaniment
+    midi = mido.MidiFile()
+    midi.tracks.append(_track(mido.MetaMessage('set_tempo', tempo=500000),
+                              mido.MetaMessage('time_signature', numerator=4, denominator=4)))
+    midi.tracks.append(_track(mido.Message('note_on', note=72, velocity=80),
+                              mido.Message('note_off', note=72, time=480)))
+    midi.tracks.append(_track(mido.Message('note_on', note=48, velocity=80),
+                              mido.Message('note_off', note=48, time=480)))
+
+    assert note_track_indices(midi) == [1, 2]
+
+
+def test_muted_track_has_no_notes():
+    midi = mido.MidiFile()
+    midi.tracks.append(_track(mido.Message('note_on', note=72, velocity=0)))
+    assert note_track_indices(midi) == []
+
+
+def _two_part_score(path):
+    music21 = pytest.importorskip('music21')
+    score = music21.stream.Score()
+    score.insert(0, music21.tempo.MetronomeMark(number=96))
+    for pitches in (['C5', 'D5', 'E5', 'F5'], ['C3', 'G3', 'C3', 'G3']):
+        part = music21.stream.Part()
+        for pitch in pitches:
+            part.append(music21.note.Note(pitch, quarterLength=1))
+        score.insert(0, part)
+    score.write('musicxml', fp=str(path))
+    return str(path)
+
+
+def test_ingest_converted_score(tmp_path):
+    midi_bytes = mxl_to_midi_bytes(_two_part_score(tmp_path / 'score.musicxml'))
+    source = ingest_score(midi_bytes)
+
+    origin_parts = note_track_indices(source["origin"])
+    assert len(origin_parts) == 2
+
+    # 멜로디 파트만 mute 되고 반주 파트와 악보의 tempo 는 그대로
+    muted = mido.MidiFile(file=io.BytesIO(source["midi"]))
+    assert note_track_indices(muted) == origin_parts[1:]
+    tempos = [msg.tempo for track in muted.tracks for msg in track if msg.type == 'set_tempo']
+    assert tempos and round(mido.tempo2bpm(tempos[0])) == 96
+    assert source["origin_after"] == source["midi"]
@@ -0,0 +1,67 @@
+import socket
+
+import pytest
+
+pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+from utils.storage import S3Storage
+
+BUCKET = 'hai-test'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def endpoint_url():
+    # moto server 를 local S3 stand-in 으로 사용 (minio 와 같은 방식으로 endpoint_url 로 접근)
+    port = _free_port()
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    yield f'http://127.0.0.1:{port}'
+    server.stop()
+
+
+@pytest.fixture
+def storage(endpoint_url):
+    storage = S3Storage(BUCKET, 'users/', aws_access_key_id='test', aws_secret_access_key='test',
+                        region='us-east-1', endpoint_url=endpoint_url)
+    try:
+        storage.client.create_bucket(Bucket=BUCKET)
+    except storage.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return storage
+
+
+def test_user_prefix_creates_folder_once(storage):
+    prefix = storage.user_prefix('alice')
+    assert prefix == 'users/alice/'
+    assert storage.exists(prefix)
+    # 두 번째 호출은 cache 된 prefix 를 그대로 반환
+    assert storage.user_prefix('alice') == prefix
+
+
+def test_upload_bytes_and_download_through_endpoint(storage, endpoint_url, tmp_path):
+    data = b'MThd' + b'\x00' * 64
+    key = storage.user_prefix('bob') + S3Storage.content_key('acc', data, '.mid')
+
+    url = storage.upload_bytes(data, key)
+    assert url == f'{endpoint_url}/{BUCKET}/{key}'
+    assert storage.exists(key)
+
+    target = tmp_path / 'acc.mid'
+    storage.download_file(key, str(target))
+    assert target.read_bytes() == data
+
+
+def test_upload_file(storage, endpoint_url, tmp_path):
+    source = tmp_path / 'ai.mp3'
+    source.write_bytes(b'ID3' + b'\x01' * 128)
+    key = storage.user_prefix('carol') + 'ai.mp3'
+
+    assert storage.upload_file(str(source), key) == f'{endpoint_url}/{BUCKET}/{key}'
+    assert not storage.exists(storage.user_prefix('carol') + 'missing.mp3')
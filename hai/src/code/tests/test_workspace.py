@@ -0,0 +1,55 @@
+import os
+import time
+
+from utils.workspace import WorkspaceManager
+
+
+def _age(path, seconds):
+    # heartbeat 를 과거로 돌려서 오래된 workspace 를 흉내
+    then = time.time() - seconds
+    os.utime(os.path.join(path, WorkspaceManager.HEARTBEAT), (then, then))
+
+
+def test_live_workspace_of_another_process_is_kept(tmp_path):
+    owner = WorkspaceManager(root=str(tmp_path), max_bytes=0, ttl_seconds=60, heartbeat_seconds=10)
+    other = WorkspaceManager(root=str(tmp_path), max_bytes=0, ttl_seconds=60, heartbeat_seconds=10)
+    path = owner.create()
+    os.makedirs(os.path.join(path, 'stems'))
+    with open(os.path.join(path, 'stems', 'acc.wav'), 'wb') as f:
+        f.write(b'0' * 1024)
+
+    # 다른 manager 는 _active 를 모르지만 heartbeat 가 새로우므로 budget 을 넘어도 지우지 않음
+    other.evict()
+    assert os.path.isdir(path)
+    owner.release(path)
+
+
+def test_stale_workspace_is_evicted_over_budget(tmp_path):
+    owner = WorkspaceManager(root=str(tmp_path), max_bytes=0, ttl_seconds=60, heartbeat_seconds=10)
+    other = WorkspaceManager(root=str(tmp_path), max_bytes=0, ttl_seconds=60, heartbeat_seconds=10)
+    path = owner.create()
+    with open(os.path.join(path, 'acc.mid'), 'wb') as f:
+        f.write(b'0' * 1024)
+    _age(path, 50)
+
+    other.evict()
+    assert not os.path.exists(path)
+
+
+def test_expired_workspace_is_evicted(tmp_path):
+    owner = WorkspaceManager(root=str(tmp_path), max_bytes=1024 ** 3, ttl_seconds=60, heartbeat_seconds=10)
+    other = WorkspaceManager(root=str(tmp_path), max_bytes=1024 ** 3, ttl_seconds=60, heartbeat_seconds=10)
+    path = owner.create()
+    _age(path, 120)
+
+    other.evict()
+    assert not os.path.exists(path)
+
+
+def test_touch_refreshes_heartbeat(tmp_path):
+    manager = WorkspaceManager(root=str(tmp_path), ttl_seconds=60, heartbeat_seconds=10)
+    path = manager.create()
+    _age(path, 120)
+    manager.touch(path)
+    assert time.time() - manager.last_used(path) < 5
+    manager.release(path)
@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+
+class AudioBuffer(object):
+    """Decodes an audio file once into a mono float32 buffer and hands out resampled views.
+
+    Tempo/key analysis (librosa, 22050 Hz) and basic-pitch transcription (22050 Hz) read from the
+    same buffer, so the file is decoded at most once and resampled at most once per rate.
+    Decoding is lazy, so a job whose stages are all memoized never touches the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._native = None
+        self._native_sr = None
+        self._resampled = {}
+        self._lock = threading.Lock()
+
+    def _decode(self):
+        if self._native is None:
+            import librosa
+            y, sr = librosa.load(self.path, sr=None, mono=True)
+            self._native = np.ascontiguousarray(y, dtype=np.float32)
+            self._native_sr = sr
+        return self._native, self._native_sr
+
+    def at(self, sr):
+        with self._lock:
+            if sr not in self._resampled:
+                y, native_sr = self._decode()
+                if native_sr != sr:
+                    import librosa
+                    y = librosa.resample(y, orig_sr=native_sr, target_sr=sr).astype(np.float32)
+                self._resampled[sr] = y
+            return self._resampled[sr]
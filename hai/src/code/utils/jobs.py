@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+import contextlib
+
+# job 상태
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    stage TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    partial TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class JobStore(object):
+    """SQLite backed job table, shared by every worker (thread or process) on the box."""
+
+    def __init__(self, db_path, max_attempts=3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'partial' not in columns:
+                # partial column 이 생기기 전에 만든 db
+                conn.execute('ALTER TABLE jobs ADD COLUMN partial TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['partial'] = json.loads(job['partial']) if job['partial'] else None
+        return job
+
+    def submit(self, payload: dict):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute('INSERT INTO jobs (id, state, stage, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, QUEUED, QUEUED, json.dumps(payload), now, now))
+        return job_id
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def claim(self):
+        # 가장 오래된 queued job 하나를 running 으로 바꾸고 반환
+        with self._lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT * FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1', (QUEUED,)).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                conn.execute('UPDATE jobs SET state = ?, stage = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                             (RUNNING, 'started', time.time(), row['id']))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        job = self._row_to_job(row)
+        job['state'] = RUNNING
+        job['attempts'] += 1
+        return job
+
+    def set_stage(self, job_id: str, stage: str):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?', (stage, time.time(), job_id))
+
+    def set_partial(self, job_id: str, partial: dict):
+        # 끝나기 전에 미리 볼 수 있는 중간 결과 (채보 중인 note 등), job 이 끝나면 지움
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET partial = ?, updated_at = ? WHERE id = ?', (json.dumps(partial), time.time(), job_id))
+
+    def heartbeat(self, job_ids):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany('UPDATE jobs SET updated_at = ? WHERE id = ? AND state = ?',
+                             [(now, job_id, RUNNING) for job_id in job_ids])
+
+    def finish(self, job_id: str, result: dict):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET state = ?, stage = ?, result = ?, partial = NULL, updated_at = ? WHERE id = ?',
+                         (DONE, DONE, json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET state = ?, stage = ?, error = ?, updated_at = ? WHERE id = ?',
+                         (FAILED, FAILED, error, time.time(), job_id))
+
+    def requeue_expired(self, lease_seconds: float):
+        # worker 가 죽어서 heartbeat(updated_at)가 끊긴 running job 을 다시 queue 에 넣음
+        deadline = time.time() - lease_seconds
+        with self._lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE jobs SET state = ?, stage = ?, error = ? WHERE state = ? AND updated_at < ? AND attempts >= ?',
+                         (FAILED, FAILED, 'worker lost too many times', RUNNING, deadline, self.max_attempts))
+            cur = conn.execute('UPDATE jobs SET state = ?, stage = ? WHERE state = ? AND updated_at < ?',
+                               (QUEUED, QUEUED, RUNNING, deadline))
+            conn.execute('COMMIT')
+        return cur.rowcount
+
+
+class JobWorkerPool(object):
+    """Pool of worker threads that take jobs from a JobStore and run `handler(payload, set_stage, set_partial)`."""
+
+    def __init__(self, store: JobStore, handler, num_workers=1, poll_interval=1.0, lease_seconds=600):
+        self.store = store
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+
+        self._wakeup = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def start(self):
+        self._stopped.clear()
+        self.store.requeue_expired(self.lease_seconds)
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name='job-worker-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run(self):
+        last_reap = 0.0
+        while not self._stopped.is_set():
+            if time.time() - last_reap > self.lease_seconds / 2:
+                self.store.requeue_expired(self.lease_seconds)
+                last_reap = time.time()
+
+            job = self.store.claim()
+            if job is None:
+                # 다른 프로세스가 넣은 job 도 잡을 수 있도록 poll_interval 마다 깨어남
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            job_id = job['id']
+            with self._active_lock:
+                self._active.add(job_id)
+            try:
+                result = self.handler(job['payload'],
+                                      lambda stage: self.store.set_stage(job_id, stage),
+                                      lambda partial: self.store.set_partial(job_id, partial))
+                self.store.finish(job_id, result)
+            except Exception as e:
+                print(f"job {job_id} failed: {e}")
+                traceback.print_exc()
+                self.store.fail(job_id, str(e))
+            finally:
+                with self._active_lock:
+                    self._active.discard(job_id)
+
+    def _heartbeat(self):
+        # 오래 걸리는 stage(sampling 등) 중에도 lease 가 만료되지 않도록 주기적으로 갱신
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._active_lock:
+                job_ids = list(self._active)
+            if job_ids:
+                self.store.heartbeat(job_ids)
@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+import shutil
+import signal
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import Future
+
+AUDIVERIS_DIR = os.environ.get('HAI_AUDIVERIS_DIR', './audiveris')
+
+
+def find_audiveris():
+    # gradle 을 거치지 않고 installDist 로 만든 launcher 를 바로 실행 (gradle daemon / 빌드 확인 시간 제거)
+    path = os.environ.get('HAI_AUDIVERIS_BIN')
+    if path:
+        return [path]
+    for name in ('Audiveris', 'audiveris'):
+        path = os.path.join(AUDIVERIS_DIR, 'build', 'install', name, 'bin', name)
+        if os.path.exists(path):
+            return [path]
+    return None
+
+
+class _OmrJob(object):
+    def __init__(self, pdf_path, output_dir):
+        self.id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.output_dir = output_dir
+        self.stem = os.path.splitext(os.path.basename(pdf_path))[0]
+        self.arrived = time.time()
+        self.future = Future()
+
+
+class OmrWorkerPool(object):
+    """Long-running Audiveris workers fed from a local queue.
+
+    Jobs that are waiting at the same time are recognised by one Audiveris batch run, so the JVM
+    start-up is paid once per batch instead of once per PDF, and the launcher is started directly
+    instead of through `gradlew run`. Every run has a timeout; on expiry the whole process group is
+    killed and the jobs of that batch fail. The future of each job resolves to the path of the
+    exported .mxl inside the job's own `output_dir`.
+    """
+
+    def __init__(self, num_workers=1, max_batch_size=4, max_wait=0.5, timeout=300, work_root=None):
+        self.command = find_audiveris()
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size if self.command else 1
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.work_root = work_root
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopped = False
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name='omr-worker-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, pdf_path, output_dir):
+        self.start()
+        job = _OmrJob(pdf_path, output_dir)
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify_all()
+        return job.future
+
+    def recognize(self, pdf_path, output_dir):
+        return self.submit(pdf_path, output_dir).result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                deadline = self._queue[0].arrived + self.max_wait
+                if len(self._queue) < self.max_batch_size and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                    continue
+                return [self._queue.popleft() for _ in range(min(self.max_batch_size, len(self._queue)))]
+        return None
+
+    def _command(self, output_dir, inputs):
+        if self.command:
+            return self.command + ['-batch', '-export', '-output', output_dir, '--'] + inputs
+        # launcher 가 없으면 기존처럼 gradle 로 실행
+        cmd_args = ','.join(['-batch', '-export', '-output', output_dir, '--'] + inputs)
+        return [os.path.join(AUDIVERIS_DIR, 'gradlew'), '-p', AUDIVERIS_DIR, 'run', f'-PcmdLineArgs={cmd_args}',
+                '-Dorg.gradle.jvmargs=-Djava.awt.headless=true']
+
+    def _run_batch(self, batch):
+        batch_dir = os.path.join(self.work_root or batch[0].output_dir, 'omr-' + uuid.uuid4().hex)
+        os.makedirs(batch_dir, exist_ok=True)
+        try:
+            # 서로 다른 job 의 파일 이름이 같아도 겹치지 않도록 job id 로 이름을 바꿔서 넣음
+            inputs = []
+            for job in batch:
+                path = os.path.join(batch_dir, job.id + '.pdf')
+                shutil.copyfile(job.pdf_path, path)
+                inputs.append(os.path.abspath(path))
+
+            process = subprocess.Popen(self._command(os.path.abspath(batch_dir), inputs),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                       env=dict(os.environ, JAVA_OPTS='-Djava.awt.headless=true'),
+                                       start_new_session=True)
+            try:
+                process.wait(timeout=self.timeout * len(batch))
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                raise TimeoutError(f"audiveris did not finish within {self.timeout * len(batch)} seconds")
+
+            for job in batch:
+                candidates = [os.path.join(batch_dir, job.id + '.mxl'),
+                              os.path.join(batch_dir, job.id, job.id + '.mxl')]
+                found = [c for c in candidates if os.path.exists(c)]
+                if not found:
+                    job.future.set_exception(RuntimeError(f"audiveris produced no score for {job.pdf_path}"))
+                    continue
+                target = os.path.join(job.output_dir, job.stem + '.mxl')
+                shutil.move(found[0], target)
+                job.future.set_result(target)
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
@@ -0,0 +1,89 @@
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class _Stage(object):
+    def __init__(self, name, fn, deps):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+class StageGraph(object):
+    """A per-request DAG of pipeline stages.
+
+    `add(name, fn, deps)` declares a stage; `fn` is called with the results of its dependencies
+    as keyword arguments. `run()` submits every stage whose dependencies are done to `executor`,
+    so independent stages (analysis and transcription, the two renders, the uploads) overlap and
+    the request takes roughly as long as its critical path. Wall-clock time of each stage is
+    kept in `timings`.
+    """
+
+    def __init__(self, executor, set_stage=None):
+        self.executor = executor
+        self.set_stage = set_stage or (lambda stage: None)
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self._running = []
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, deps=()):
+        assert name not in self.stages, f"duplicated stage {name}"
+        self.stages[name] = _Stage(name, fn, deps)
+        return name
+
+    def _report(self):
+        with self._lock:
+            running = ','.join(self._running)
+        if running:
+            self.set_stage(running)
+
+    def _call(self, stage, kwargs):
+        with self._lock:
+            self._running.append(stage.name)
+        self._report()
+        start = time.time()
+        try:
+            return stage.fn(**kwargs)
+        finally:
+            self.timings[stage.name] = time.time() - start
+            with self._lock:
+                self._running.remove(stage.name)
+
+    def run(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                assert dep in self.stages, f"stage {stage.name} depends on unknown stage {dep}"
+
+        pending = dict(self.stages)
+        futures = {}
+        start = time.time()
+        while pending or futures:
+            for name, stage in list(pending.items()):
+                if all(dep in self.results for dep in stage.deps):
+                    kwargs = {dep: self.results[dep] for dep in stage.deps}
+                    futures[self.executor.submit(self._call, stage, kwargs)] = name
+                    del pending[name]
+
+            if not futures:
+                raise RuntimeError(f"stages can not be scheduled (cycle?): {sorted(pending)}")
+
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    self.results[name] = future.result()
+                except Exception:
+                    # 나머지 stage 는 더 이상 시작하지 않고, 이미 돌고 있는 것은 끝나기를 기다림
+                    for f in futures:
+                        f.cancel()
+                    wait(list(futures))
+                    raise
+
+        self.timings['total'] = time.time() - start
+        return self.results
+
+    def summary(self):
+        return ' '.join(f"{name}={seconds:.2f}s" for name, seconds in sorted(self.timings.items(), key=lambda kv: kv[1], reverse=True))
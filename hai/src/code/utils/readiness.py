@@ -0,0 +1,77 @@
+import time
+import threading
+import traceback
+
+
+class BackgroundLoader(object):
+    """Loads the models on a background thread so the server can answer probes while loading.
+
+    `state` goes `loading` -> `warming` -> `ready`, or ends in `failed` with the error kept for
+    `/readyz`. `load` builds the models, `warmup` runs synthetic requests through them (a failing
+    warmup is reported but does not keep the worker unready), and `on_ready` is called once both
+    have finished (the job workers are started from there, so jobs submitted while loading wait
+    in the job store).
+    """
+
+    def __init__(self, load, warmup=None, on_ready=None):
+        self.load = load
+        self.warmup = warmup
+        self.on_ready = on_ready
+
+        self.state = 'created'
+        self.error = None
+        self.warmup_error = None
+        self.timings = {}
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.state = 'loading'
+        self._thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        status = {"state": self.state, "timings": {k: round(v, 2) for k, v in self.timings.items()}}
+        if self.error is not None:
+            status["error"] = self.error
+        if self.warmup_error is not None:
+            status["warmup_error"] = self.warmup_error
+        return status
+
+    def _run(self):
+        try:
+            start = time.time()
+            self.load()
+            self.timings['load'] = time.time() - start
+
+            if self.warmup is not None:
+                self.state = 'warming'
+                start = time.time()
+                try:
+                    self.warmup()
+                except Exception as e:
+                    # warmup 은 첫 request 의 latency 를 줄이기 위한 것이라 실패해도 ready 로 넘어감
+                    traceback.print_exc()
+                    self.warmup_error = f"{type(e).__name__}: {e}"
+                self.timings['warmup'] = time.time() - start
+
+            if self.on_ready is not None:
+                self.on_ready()
+        except Exception as e:
+            traceback.print_exc()
+            self.state = 'failed'
+            self.error = f"{type(e).__name__}: {e}"
+            return
+
+        self.state = 'ready'
+        self._ready.set()
+        print(f"models ready: {self.status()}")
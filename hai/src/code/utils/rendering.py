@@ -0,0 +1,182 @@
+import io
+import os
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import mido
+import pretty_midi
+
+# optional: 설치되어 있으면 in-process 로 합성 / mp3 인코딩, 없으면 timidity / lame 로 fallback
+try:
+    import fluidsynth
+except ImportError:
+    fluidsynth = None
+
+try:
+    import lameenc
+except ImportError:
+    lameenc = None
+
+
+SOUNDFONT_PATHS = [
+    '/usr/share/sounds/sf2/FluidR3_GM.sf2',
+    '/usr/share/soundfonts/FluidR3_GM.sf2',
+    '/usr/share/soundfonts/default.sf2',
+]
+
+
+def find_soundfont():
+    path = os.environ.get('HAI_SOUNDFONT')
+    if path:
+        return path
+    for path in SOUNDFONT_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _to_pretty_midi(midi):
+    if isinstance(midi, pretty_midi.PrettyMIDI):
+        return midi
+    if isinstance(midi, mido.MidiFile):
+        buf = io.BytesIO()
+        midi.save(file=buf)
+        midi = buf.getvalue()
+    return pretty_midi.PrettyMIDI(io.BytesIO(midi))
+
+
+def _midi_bytes(midi):
+    if isinstance(midi, (bytes, bytearray)):
+        return bytes(midi)
+    buf = io.BytesIO()
+    if isinstance(midi, mido.MidiFile):
+        midi.save(file=buf)
+    else:
+        midi.write(buf)
+    return buf.getvalue()
+
+
+def mix_stems(stems, gains=None):
+    # pydub overlay 와 같이 가장 짧은 stem 길이에 맞춰 자른 뒤 더함 (clip 은 encode 에서)
+    gains = gains or [1.0] * len(stems)
+    length = min(len(stem) for stem in stems)
+    mixed = np.zeros((length, stems[0].shape[1]), dtype=np.float32)
+    for stem, gain in zip(stems, gains):
+        mixed += gain * stem[:length]
+    return mixed
+
+
+class RenderService(object):
+    """Renders MIDI to PCM (float32, shape (n, 2)) and encodes MP3 without per-call process startup.
+
+    Each worker thread keeps its own long-lived FluidSynth instance with the soundfont already
+    loaded, so independent renders run in parallel. Without pyfluidsynth or a soundfont it falls
+    back to piping through timidity, and without lameenc MP3 encoding falls back to lame.
+    """
+
+    def __init__(self, soundfont=None, num_workers=2, sample_rate=44100, bitrate=192, tail_seconds=1.0):
+        self.soundfont = soundfont or find_soundfont()
+        self.sample_rate = sample_rate
+        self.bitrate = bitrate
+        self.tail_seconds = tail_seconds
+        self.in_process = fluidsynth is not None and self.soundfont is not None
+
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='render')
+        if not self.in_process:
+            print("RenderService: pyfluidsynth or soundfont not available, using timidity")
+
+    def submit(self, midi):
+        return self._executor.submit(self.render, midi)
+
+    def render(self, midi):
+        if self.in_process:
+            return self._render_fluidsynth(_to_pretty_midi(midi))
+        return self._render_timidity(_midi_bytes(midi))
+
+    def _synth(self):
+        synth = getattr(self._local, 'synth', None)
+        if synth is None:
+            synth = fluidsynth.Synth(samplerate=float(self.sample_rate))
+            self._local.sfid = synth.sfload(self.soundfont)
+            self._local.synth = synth
+        return synth
+
+    def _render_fluidsynth(self, pm):
+        synth = self._synth()
+        sfid = self._local.sfid
+        if hasattr(synth, 'system_reset'):
+            synth.system_reset()
+        else:
+            for chan in range(16):
+                synth.cc(chan, 123, 0)  # all notes off
+                synth.cc(chan, 121, 0)  # reset controllers
+
+        events = []
+        channel = 0
+        for inst in pm.instruments:
+            if inst.is_drum:
+                chan = 9
+                synth.program_select(chan, sfid, 128, inst.program)
+            else:
+                chan = channel
+                channel = (channel + 1) % 16
+                if channel == 9:
+                    channel = 10
+                synth.program_select(chan, sfid, 0, inst.program)
+            # 같은 시각이면 noteoff 가 noteon 보다 먼저 처리되도록 순서 값을 둠
+            for note in inst.notes:
+                events.append((note.start, 1, chan, 'on', note.pitch, note.velocity))
+                events.append((note.end, 0, chan, 'off', note.pitch, 0))
+            for bend in inst.pitch_bends:
+                events.append((bend.time, 1, chan, 'bend', bend.pitch, 0))
+            for cc in inst.control_changes:
+                events.append((cc.time, 1, chan, 'cc', cc.number, cc.value))
+        events.sort(key=lambda e: (e[0], e[1]))
+
+        chunks = []
+        position = 0
+        for time, _, chan, kind, a, b in events:
+            target = int(round(time * self.sample_rate))
+            if target > position:
+                chunks.append(synth.get_samples(target - position))
+                position = target
+            if kind == 'on':
+                synth.noteon(chan, a, b)
+            elif kind == 'off':
+                synth.noteoff(chan, a)
+            elif kind == 'bend':
+                synth.pitch_bend(chan, a)
+            else:
+                synth.cc(chan, a, b)
+        chunks.append(synth.get_samples(int(self.tail_seconds * self.sample_rate)))
+
+        pcm = np.concatenate(chunks).astype(np.float32).reshape(-1, 2) / 32768.0
+        return pcm
+
+    def _render_timidity(self, midi_bytes):
+        # raw 16bit signed stereo 를 stdout 으로 받음
+        raw = subprocess.run(['timidity', '-', '-Or1slS', '-s', str(self.sample_rate), '-o', '-'],
+                             input=midi_bytes, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        raw = raw[:len(raw) // 4 * 4]
+        return np.frombuffer(raw, dtype='<i2').astype(np.float32).reshape(-1, 2) / 32768.0
+
+    def encode_mp3(self, pcm):
+        pcm16 = (np.clip(pcm, -1.0, 1.0) * 32767.0).astype('<i2')
+        if lameenc is not None:
+            encoder = lameenc.Encoder()
+            encoder.set_bit_rate(self.bitrate)
+            encoder.set_in_sample_rate(self.sample_rate)
+            encoder.set_channels(pcm16.shape[1])
+            encoder.set_quality(2)
+            return bytes(encoder.encode(pcm16.tobytes()) + encoder.flush())
+
+        mode = 's' if pcm16.shape[1] == 2 else 'm'
+        return subprocess.run(['lame', '--silent', '-r', '-s', str(self.sample_rate / 1000), '--bitwidth', '16',
+                               '--signed', '--little-endian', '-m', mode, '-b', str(self.bitrate), '-', '-'],
+                              input=pcm16.tobytes(), stdout=subprocess.PIPE, check=True).stdout
+
+    def close(self):
+        self._executor.shutdown(wait=True)
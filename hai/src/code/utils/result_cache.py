@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import contextlib
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    checkpoint TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def file_sha256(path, chunk_size=1024 ** 2):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def checkpoint_identity(path):
+    # 파일 내용 전체를 hash 하지 않고 (path, size, mtime) 으로 checkpoint 교체를 감지
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    ident = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha256(ident.encode()).hexdigest()[:16]
+
+
+class ResultCache(object):
+    """Maps (input content hash, request fields, seed, checkpoint) to the uploaded artifact urls.
+
+    Backed by SQLite so that every worker on the box shares it. Least recently used entries are
+    evicted above `max_entries`, and entries made with another checkpoint are dropped as soon as
+    `checkpoint_path` changes on disk.
+    """
+
+    def __init__(self, db_path, checkpoint_path, max_entries=1000):
+        self.db_path = db_path
+        self.checkpoint_path = checkpoint_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._checkpoint = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def checkpoint(self):
+        current = checkpoint_identity(self.checkpoint_path)
+        if current != self._checkpoint:
+            with self._lock, self._connect() as conn:
+                conn.execute('DELETE FROM results WHERE checkpoint != ?', (current,))
+            self._checkpoint = current
+        return current
+
+    def make_key(self, input_hash: str, fields: dict, seed):
+        payload = json.dumps({'input': input_hash, 'fields': fields, 'seed': seed,
+                              'checkpoint': self.checkpoint()}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str):
+        checkpoint = self.checkpoint()
+        with self._connect() as conn:
+            row = conn.execute('SELECT result FROM results WHERE key = ? AND checkpoint = ?',
+                               (key, checkpoint)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, result: dict):
+        checkpoint = self.checkpoint()
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO results (key, checkpoint, result, created_at, last_used) VALUES (?, ?, ?, ?, ?)',
+                         (key, checkpoint, json.dumps(result), now, now))
+            conn.execute('DELETE FROM results WHERE key IN '
+                         '(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
@@ -0,0 +1,74 @@
+import io
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import mido
+
+
+def mxl_to_midi_bytes(mxl_path: str):
+    # MusicXML(.mxl / .musicxml) -> .mid bytes, xvfb + MuseScore 없이 music21 로 변환
+    import music21
+
+    score = music21.converter.parse(mxl_path)
+    midi_file = music21.midi.translate.streamToMidiFile(score)
+    return midi_file.writestr()
+
+
+def note_track_indices(midi):
+    # music21 의 streamToMidiFile 은 tempo / 박자만 있는 conductor track 을 track 0 으로 씀
+    # -> 실제 note 가 있는 track 만 골라서 파트를 구분
+    return [i for i, track in enumerate(midi.tracks)
+            if any(msg.type == 'note_on' and msg.velocity > 0 for msg in track)]
+
+
+def ingest_score(score: bytes):
+    # 변환된 악보 midi -> pipeline 의 source (원본, 멜로디를 mute 한 midi)
+    # tempo 는 music21 이 악보의 빠르기표 (없으면 120) 로 써 둔 값을 그대로 사용
+    midi_data = mido.MidiFile(file=io.BytesIO(score))
+    midi_data_origin = copy.deepcopy(midi_data)
+
+    # 파트가 둘 이상이면 첫 파트 (멜로디) 를 mute, conductor track 은 건너뜀
+    note_tracks = note_track_indices(midi_data)
+    if len(note_tracks) >= 2:
+        melody = note_tracks[0]
+        new_track = mido.MidiTrack()
+        for msg in midi_data.tracks[melody]:
+            if isinstance(msg, mido.MetaMessage):
+                new_track.append(msg)
+            else:
+                if 'velocity' in msg.dict():
+                    msg.velocity = 0
+                    new_track.append(msg)
+        midi_data.tracks[melody] = new_track
+
+    buf = io.BytesIO()
+    midi_data.save(file=buf)
+    midi_bytes = buf.getvalue()
+    return {"origin": midi_data_origin, "origin_after": midi_bytes, "midi": midi_bytes, "resolution": 480}
+
+
+class ScoreConverter(object):
+    """Converts MusicXML to MIDI on a small process pool.
+
+    music21 parsing is pure Python and holds the GIL, so it runs in separate processes
+    (spawned, so the children do not inherit torch / model state) to keep the job threads free.
+    """
+
+    def __init__(self, num_workers=1):
+        self.num_workers = num_workers
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def to_midi(self, mxl_path: str, timeout=None):
+        return self._pool().submit(mxl_to_midi_bytes, mxl_path).result(timeout)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
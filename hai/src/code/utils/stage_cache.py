@@ -0,0 +1,87 @@
+import os
+import time
+import uuid
+import pickle
+import hashlib
+import threading
+
+
+class StageCache(object):
+    """Pickled intermediate results of the pipeline, keyed by stage name and input hash.
+
+    Transcription, tempo/key analysis, accompaniment separation and octuple encoding only
+    depend on the uploaded file (and a few request fields), so re-generating the same upload
+    with another `content_name` can reuse them and jump straight to sampling.
+    The directory is kept under `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, root, max_bytes=1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.root, stage, key + '.pkl')
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)  # LRU 기준 갱신
+        except OSError:
+            pass
+        return value
+
+    def put(self, stage, key, value):
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 다른 worker 가 읽는 도중 반쯤 쓰인 파일을 보지 않도록 rename 으로 교체
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def memoize(self, stage, key, fn):
+        value = self.get(stage, key)
+        if value is None:
+            value = fn()
+            self.put(stage, key, value)
+        else:
+            print(f"stage cache hit: {stage}")
+        return value
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for root, dirs, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.endswith('.tmp') and time.time() - st.st_mtime > 3600:
+                        os.remove(path)
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
@@ -0,0 +1,105 @@
+import io
+import hashlib
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+
+
+class S3Storage(object):
+    """One long-lived S3 client shared by every job thread.
+
+    boto3 clients are thread-safe, so a single client with a large enough connection pool
+    replaces the per-call `boto3.client(...)`. User folders that are known to exist are cached
+    so that the HEAD/PUT pair runs once per user per process. `endpoint_url` points the client
+    at a local S3 stand-in (minio, moto server, ...).
+    """
+
+    def __init__(self, bucket, folder='', aws_access_key_id=None, aws_secret_access_key=None,
+                 region='ap-northeast-2', endpoint_url=None, max_pool_connections=32,
+                 multipart_chunksize=8 * 1024 ** 2):
+        self.bucket = bucket
+        self.folder = folder
+        self.region = region
+        self.endpoint_url = endpoint_url
+
+        self.client = boto3.client('s3',
+                                   aws_access_key_id=aws_access_key_id,
+                                   aws_secret_access_key=aws_secret_access_key,
+                                   region_name=region,
+                                   endpoint_url=endpoint_url,
+                                   config=Config(max_pool_connections=max_pool_connections,
+                                                 retries={'max_attempts': 5, 'mode': 'standard'}))
+        # 큰 파일은 multipart 로 나눠서 병렬 전송
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunksize,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=4,
+                                              use_threads=True)
+
+        self._known_prefixes = set()
+        self._lock = threading.Lock()
+
+    def object_url(self, key):
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def user_prefix(self, user):
+        prefix = self.folder + user + '/'
+        with self._lock:
+            if prefix in self._known_prefixes:
+                return prefix
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=prefix)
+        except ClientError as e:
+            # 폴더가 없는 경우에만 폴더 생성
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            self.client.put_object(Bucket=self.bucket, Key=prefix)
+            print(f"{self.bucket} 버킷에 {prefix} 폴더가 생성되었습니다.")
+
+        with self._lock:
+            self._known_prefixes.add(prefix)
+        return prefix
+
+    @staticmethod
+    def content_key(name, data, ext):
+        # 같은 이름이라도 내용이 다르면 key 가 달라지므로 HEAD 로 충돌 확인을 할 필요가 없음
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        return f"{name}_{digest}{ext}"
+
+    def exists(self, key, bucket=None):
+        try:
+            self.client.head_object(Bucket=bucket or self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+    def download_file(self, key, local_file_name, bucket=None):
+        return self.client.download_file(Bucket=bucket or self.bucket, Key=key, Filename=local_file_name,
+                                         Config=self.transfer_config)
+
+    def upload_file(self, local_file_name, key):
+        try:
+            self.client.upload_file(local_file_name, self.bucket, key, Config=self.transfer_config)
+            return self.object_url(key)
+        except ClientError as e:
+            print(f"Error uploading to S3: {e}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error uploading to S3: {e}")
+            return None
+
+    def upload_bytes(self, data, key):
+        try:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, key, Config=self.transfer_config)
+            return self.object_url(key)
+        except ClientError as e:
+            print(f"Error uploading to S3: {e}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error uploading to S3: {e}")
+            return None
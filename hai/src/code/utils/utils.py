@@ -1,18 +1,16 @@
 import sys
 import os
+import io
 import yaml
 import json
 import requests
+import requests.adapters
 import re
 import mido
-import boto3
-from pydub import AudioSegment
-import librosa
+import numpy as np
 from miditoolkit import MidiFile
-import random
-import string
-from botocore.exceptions import ClientError
-import subprocess
+import threading
+import time
 
 from tqdm import tqdm
 
@@ -30,31 +28,92 @@ AWS_ACCESS_KEY_ID = config['AWS_ACCESS_KEY_ID']
 AWS_SECRET_ACCESS_KEY = config['AWS_SECRET_ACCESS_KEY']
 BUCKET_NAME = config['BUCKET_NAME']
 FOLDER_NAME = config['FOLDER_NAME']
-
+S3_REGION = config.get('S3_REGION', 'ap-northeast-2')
+# local S3 stand-in (minio 등)을 쓸 때 지정
+S3_ENDPOINT_URL = os.environ.get('HAI_S3_ENDPOINT_URL', config.get('S3_ENDPOINT_URL'))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    # process 전체에서 하나의 S3 client(connection pool)를 공유
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            # boto3 는 처음 S3 에 접근할 때 import (worker 기동 시간 단축)
+            from utils.storage import S3Storage
+            _storage = S3Storage(BUCKET_NAME, FOLDER_NAME,
+                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
+                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                                 region=S3_REGION,
+                                 endpoint_url=S3_ENDPOINT_URL)
+        return _storage
 
 def download_from_s3(bucket_name: str, local_file_name: str, key: str):    
-    s3_client = boto3.client(service_name='s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-    res = s3_client.download_file(Bucket=bucket_name, Key=key, Filename=local_file_name)
-
-    return res
+    return get_storage().download_file(key, local_file_name, bucket=bucket_name)
+
+# 입력 다운로드 제한
+DOWNLOAD_MAX_BYTES = int(os.environ.get('HAI_DOWNLOAD_MAX_MB', 200)) * 1024 ** 2
+DOWNLOAD_TIMEOUT = float(os.environ.get('HAI_DOWNLOAD_TIMEOUT', 120))
+DOWNLOAD_CHUNK_SIZE = 1024 ** 2
+
+_http_session = None
+
+def get_http_session():
+    # keep-alive connection 을 재사용하도록 session 하나를 공유
+    global _http_session
+    with _storage_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=3)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def download_from_s3_requests(s3_url: str, local_file_path: str, max_bytes: int = None, timeout: float = None):
+    # response 전체를 메모리에 올리지 않고 chunk 단위로 workspace 에 바로 기록
+    max_bytes = max_bytes or DOWNLOAD_MAX_BYTES
+    timeout = timeout or DOWNLOAD_TIMEOUT
+    deadline = time.time() + timeout
+    part_path = local_file_path + '.part'
 
-def download_from_s3_requests(s3_url: str, local_file_path: str):
     try:
-        response = requests.get(s3_url)
-        response.raise_for_status()  # 요청이 실패했을 경우 예외 발생
+        with get_http_session().get(s3_url, stream=True, timeout=(5, min(timeout, 30))) as response:
+            response.raise_for_status()  # 요청이 실패했을 경우 예외 발생
+
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if content_length > max_bytes:
+                print(f"Error downloading from S3: {content_length} bytes exceeds limit {max_bytes}")
+                return False
+
+            written = 0
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise IOError(f"download exceeds limit {max_bytes} bytes")
+                    if time.time() > deadline:
+                        raise IOError(f"download took longer than {timeout} seconds")
+                    f.write(chunk)
+        os.replace(part_path, local_file_path)
+
     except requests.exceptions.RequestException as e:
         print(f"Error downloading from S3: {e}")
         return False  # 다운로드 실패를 나타내는 값 반환
 
-    try:
-        with open(local_file_path, 'wb') as f:
-            f.write(response.content)
     except IOError as e:
         print(f"Error writing to local file: {e}")
         return False  # 파일 쓰기 실패를 나타내는 값 반환
 
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
     return os.path.exists(local_file_path)
 
+
 def get_bucket_region_from_s3_url(s3_url: str):
     pattern = r'^https://([^.]+)\.s3\.([^.]+)\.amazonaws\.com'
     match = re.match(pattern, s3_url)
@@ -65,52 +124,11 @@ def get_bucket_region_from_s3_url(s3_url: str):
     else:
         return None, None
 
+
 def get_file_path_from_s3_url(s3_url: str):
     file_path = s3_url.split('/')[-1]
     return os.path.basename(file_path)
 
-def get_s3_client():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    config_file_path = os.path.join(current_dir, '../../../..', 'configs', 'config.json')
-    
-    with open(config_file_path, 'r') as f:
-        config = json.load(f)
-    
-    s3_client = boto3.client('s3',
-                             aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
-                             aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'])
-    
-    return s3_client
-
-def check_file_exists(bucket_name, file_key):
-    s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-    
-    try:
-        s3.head_object(Bucket=bucket_name, Key=file_key)
-        return True
-    except Exception as e:
-        return False
-
-
-
-def make_s3_folder(s3_client: boto3.client, user: str):
-
-    try:
-        # 해당 경로의 객체를 가져와서 예외가 발생하지 않으면 폴더가 이미 존재한다는 것
-        s3_client.head_object(Bucket=BUCKET_NAME, Key=(FOLDER_NAME+user+'/'))
-        print("created!")
-    except ClientError as e:
-        # 폴더가 없는 경우에만 폴더 생성
-        if e.response['Error']['Code'] == '404':
-            s3_client.put_object(Bucket=BUCKET_NAME, Key=(FOLDER_NAME+user+'/'))
-            print(f"{BUCKET_NAME} 버킷에 {FOLDER_NAME+user} 폴더가 생성되었습니다.")
-        else:
-            # 다른 에러인 경우 예외 발생
-            raise
-    else:
-        print(f"{BUCKET_NAME} 버킷에 {FOLDER_NAME+user} 폴더는 이미 존재합니다.")
-    
-    return FOLDER_NAME+user+'/'
 
 def make_and_get_user_folder(file_name: str, user: str):
     data_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../data'))
@@ -120,6 +138,7 @@ def make_and_get_user_folder(file_name: str, user: str):
 
     return file_path
 
+
 def make_and_get_user_folder_path(user: str):
     data_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../data'))
     user_folder = os.path.join(data_path, user)
@@ -127,26 +146,20 @@ def make_and_get_user_folder_path(user: str):
 
     return user_folder
 
-def upload_to_s3(local_file_name: str, key: str):
-    try:
-        s3_client = boto3.client(service_name='s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-        s3_client.upload_file(local_file_name, BUCKET_NAME, key)
-
-        # 권한 설정을 위한 코드 (선택 사항)
-        # s3_client.put_object_acl(ACL='public-read', Bucket=BUCKET_NAME, Key=key)
-        
-        object_url = f"https://{BUCKET_NAME}.s3.ap-northeast-2.amazonaws.com/{key}"
-        return object_url
 
-    except ClientError as e:
-        # 업로드 중에 발생한 클라이언트 오류 처리
-        print(f"Error uploading to S3: {e}")
-        return None
+def midi_to_bytes(midi):
+    # mido / pretty_midi / miditoolkit 객체를 .mid 바이트로 직렬화
+    buf = io.BytesIO()
+    if isinstance(midi, mido.MidiFile):
+        midi.save(file=buf)
+    elif isinstance(midi, pretty_midi.PrettyMIDI):
+        midi.write(buf)
+    else:
+        midi.dump(file=buf)
+    return buf.getvalue()
 
-    except Exception as e:
-        # 기타 예외 처리
-        print(f"Unexpected error uploading to S3: {e}")
-        return None
+def mido_from_bytes(data: bytes):
+    return mido.MidiFile(file=io.BytesIO(data))
 
 
 def change_instrument1(instrument: str, midi_object: pretty_midi.PrettyMIDI):
@@ -361,7 +374,7 @@ def modify_midi_velocity(midi_data, piano_velocity=50, guitar_velocity=70, bass_
 
 
 
-def remove_instrument_events(mid, instrument, output_path):
+def remove_instrument_events(mid, instrument, output_path=None):
     # 특정 악기 이벤트를 제거할 새로운 MIDI 파일 객체 생성
 
     if instrument == 'p':
@@ -395,25 +408,23 @@ def remove_instrument_events(mid, instrument, output_path):
         track.clear()
         track.extend(new_msgs)
 
-    mid.save(output_path)
+    if output_path is not None:
+        mid.save(output_path)
     return mid
 
-def extract_tempo(audio_path: str):
-    y, sr = librosa.load(audio_path)
+def extract_tempo(audio_path: str = None, y=None, sr=22050):
+    # y 가 주어지면 (이미 decode 된 buffer) 파일을 다시 읽지 않음
+    import librosa
+    if y is None:
+        y, sr = librosa.load(audio_path)
     tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
     return tempo
 
-def make_audio_to_mp3(audio_path: str):
-    output_file_path = audio_path.split('.')[0] + ".mp3"
-
-    audio = AudioSegment.from_file(audio_path)
-    audio.export(output_file_path, format="mp3")
-
-    return output_file_path
-
-def extract_key(audio_path: str):
+def extract_key(audio_path: str = None, y=None, sr=22050):
+    import librosa
     # 오디오 파일을 로드합니다.
-    y, sr = librosa.load(audio_path)
+    if y is None:
+        y, sr = librosa.load(audio_path)
     
     # 피치 클래스 (C, C#, D, D#, E, F, F#, G, G#, A, A#, B) 프로필을 추출합니다.
     chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
@@ -424,13 +435,69 @@ def extract_key(audio_path: str):
     # 가장 높은 값을 가진 피치 클래스를 찾습니다.
     key_index = chroma_mean.argmax()
     
-    # 피치 클래스에 해당하는 키를 정의합니다.
-    keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    
-    # 키를 반환합니다.
-    return keys[key_index]
+    # 피치 클래스에 해당하는 키를 반환합니다. (mido key_signature 에서 쓸 수 있는 이름)
+    return MAJOR_KEY_NAMES[key_index]
 
-def separate_melody(midi_file: mido.MidiFile, midi_path: str, resolution: int):
+# mido key_signature 에서 쓸 수 있는 이름 (D#, G#, A# major 는 mido 가 받지 않음)
+MAJOR_KEY_NAMES = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+MINOR_KEY_NAMES = ['Cm', 'C#m', 'Dm', 'Ebm', 'Em', 'Fm', 'F#m', 'Gm', 'G#m', 'Am', 'Bbm', 'Bm']
+
+def estimate_key_from_notes(note_events, key_profile):
+    # track_generation.normalize_to_c_major 와 같은 방식 (duration * amplitude 가중 pitch class histogram 과 key profile 의 내적)
+    # note_events: basic-pitch (start_s, end_s, pitch, amplitude, pitch_bends)
+    if len(note_events) == 0:
+        return None
+    pitch_classes = np.array([int(n[2]) % 12 for n in note_events])
+    weights = np.array([(n[1] - n[0]) * n[3] for n in note_events], dtype=np.float64)
+    histogram = np.bincount(pitch_classes, weights=weights, minlength=12)
+    if histogram.sum() == 0:
+        return None
+    histogram /= histogram.sum()
+
+    # key profile 에서 major 와 relative minor 는 같은 row 라 점수가 항상 같음 (0~11: major, 12~23: minor)
+    # normalize_to_c_major 처럼 두 후보의 tonic 비중이 큰 쪽을 선택
+    scores = np.dot(key_profile, histogram)
+    candidates = np.flatnonzero(np.isclose(scores, scores.max()))
+    majors = [int(k) for k in candidates if k < 12]
+    minors = [int(k) for k in candidates if k >= 12]
+    if majors and minors:
+        major_index, minor_index = majors[0], minors[0]
+        if histogram[major_index] < histogram[minor_index % 12]:
+            return MINOR_KEY_NAMES[minor_index % 12]
+        return MAJOR_KEY_NAMES[major_index]
+    if majors:
+        return MAJOR_KEY_NAMES[majors[0]]
+    return MINOR_KEY_NAMES[minors[0] % 12]
+
+def estimate_tempo_from_notes(note_events, fps=100, min_bpm=60, max_bpm=200, start_bpm=120):
+    # onset 간격의 autocorrelation 으로 beat 주기를 찾음 (librosa beat_track 과 같은 log-normal prior)
+    if len(note_events) < 8:
+        return None
+    onsets = np.array([n[0] for n in note_events], dtype=np.float64)
+    amplitudes = np.array([n[3] for n in note_events], dtype=np.float64)
+
+    n_frames = int(np.ceil(onsets.max() * fps)) + 1
+    envelope = np.zeros(n_frames)
+    np.add.at(envelope, (onsets * fps).astype(int), amplitudes)
+    envelope = np.convolve(envelope, np.hanning(5), mode='same')
+    envelope -= envelope.mean()
+
+    spectrum = np.fft.rfft(envelope, n=2 * n_frames)
+    autocorr = np.fft.irfft(np.abs(spectrum) ** 2)[:n_frames]
+
+    bpms = np.arange(min_bpm, max_bpm + 0.5, 0.5)
+    lags = np.round(60.0 * fps / bpms).astype(int)
+    valid = lags < n_frames
+    if not valid.any():
+        return None
+    bpms, lags = bpms[valid], lags[valid]
+    prior = np.exp(-0.5 * (np.log2(bpms) - np.log2(start_bpm)) ** 2)
+    score = autocorr[lags] * prior
+    if score.max() <= 0:
+        return None
+    return float(bpms[int(np.argmax(score))])
+
+def separate_melody(midi_file: mido.MidiFile, resolution: int):
 
     # 멜로디와 반주를 위한 새로운 MIDI 파일 생성
     melody_file = mido.MidiFile(ticks_per_beat=resolution)
@@ -471,14 +538,7 @@ def separate_melody(midi_file: mido.MidiFile, midi_path: str, resolution: int):
                 new_melody_track.append(msg)
                 new_accompaniment_track.append(msg)
     
-    # 새로운 MIDI 파일 저장
-    accompaniment_path = midi_path.split('/')[-1].split('.')[0] + "_accompaniment.mid"
-    melody_path = midi_path.split('/')[-1].split('.')[0] + "_melody.mid"
-
-    accompaniment_file.save(accompaniment_path)
-    melody_file.save(melody_path)
-
-    return melody_path, accompaniment_path
+    return melody_file, accompaniment_file
 
 
 def change_tempo(mid: mido.MidiFile, tempo: int):
@@ -534,11 +594,3 @@ def remove_pitchwheel(midi_path: str):
 def get_midi_division(midi_path: str) -> int:
     midi_file = mido.MidiFile(midi_path)
     return midi_file.ticks_per_beat
-
-def generate_random_string(length=4):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
-
-def convert_midi_to_mp3(input_midi, output_mp3):
-    timidity_process = subprocess.run(['timidity', input_midi, '-Ow', '-o', 'output.wav'])
-    lame_process = subprocess.run(['lame', 'output.wav', output_mp3])
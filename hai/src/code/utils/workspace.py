@@ -0,0 +1,130 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+import contextlib
+
+
+def default_workspace_root():
+    # tmpfs 가 있으면 RAM 위에서 작업 (중간 midi/wav 파일이 많음)
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm/hai-workspaces'
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../data/workspaces'))
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager(object):
+    """Hands out a private scratch directory per job and keeps the root under a disk budget.
+
+    The root can be shared by several worker processes, so liveness is kept on disk: every
+    workspace holds a heartbeat file that its owner touches every `heartbeat_seconds` while the
+    job runs. Directories whose heartbeat is fresh are never evicted, whichever process owns
+    them. Directories of finished jobs are removed right away; leftovers (e.g. from a crashed
+    worker) are evicted once their heartbeat is older than `ttl_seconds`, and stale ones are
+    evicted least recently used first whenever the root grows over `max_bytes`.
+    """
+
+    HEARTBEAT = '.heartbeat'
+
+    def __init__(self, root=None, max_bytes=2 * 1024 ** 3, ttl_seconds=3600, heartbeat_seconds=30):
+        self.root = root or default_workspace_root()
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        # heartbeat 를 몇 번 놓치면 주인이 없는 것으로 봄
+        self.stale_seconds = min(heartbeat_seconds * 4, ttl_seconds)
+
+        self._active = set()
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def create(self, name=None):
+        self.evict()
+        path = os.path.join(self.root, name or uuid.uuid4().hex)
+        os.makedirs(path, exist_ok=True)
+        self.touch(path)
+        with self._lock:
+            self._active.add(path)
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='workspace-heartbeat', daemon=True)
+                self._heartbeat_thread.start()
+        return path
+
+    def release(self, path):
+        with self._lock:
+            self._active.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def workspace(self, name=None):
+        path = self.create(name)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def touch(self, path):
+        # directory 의 mtime 은 하위 directory 에 쓸 때 바뀌지 않으므로 별도 file 로 기록
+        try:
+            with open(os.path.join(path, self.HEARTBEAT), 'a'):
+                pass
+            os.utime(os.path.join(path, self.HEARTBEAT))
+        except OSError:
+            pass
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self._lock:
+                active = list(self._active)
+            for path in active:
+                self.touch(path)
+
+    def last_used(self, path):
+        try:
+            return os.path.getmtime(os.path.join(path, self.HEARTBEAT))
+        except OSError:
+            # heartbeat 가 없는 directory (생성 직후이거나 이전 version) 는 directory mtime 으로
+            return os.path.getmtime(path)
+
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            active = set(self._active)
+
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path in active or not os.path.isdir(path):
+                continue
+            try:
+                age = now - self.last_used(path)
+            except OSError:
+                continue
+            if age <= self.stale_seconds:
+                # 다른 process 에서 실행 중인 job
+                continue
+            if age > self.ttl_seconds:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                entries.append((now - age, path))
+
+        total = _dir_size(self.root)
+        for last_used, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            size = _dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -1,43 +1,38 @@
 import os
 import json
+import hashlib
 import subprocess
 import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import miditoolkit
+import pretty_midi
 import numpy as np
 
-<<<<<<< HEAD
-from fastapi import APIRouter, Request
-import music21
-=======
-from fastapi import FastAPI, APIRouter, Response, HTTPException, Request
-from fastapi.responses import JSONResponse
-import torch
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
+from fastapi import APIRouter, HTTPException, Request
 
 from models.schemas import GenerationInput
-from models.music_models import Mp3ToMIDIModel
-
-from models.track_generation import tokens_to_ids, ids_to_tokens, empty_index, pad_index
-<<<<<<< HEAD
-from models.track_generation import F, encoding_to_MIDI, parse_condition, parse_content
-=======
-from models.track_generation import F, encoding_to_MIDI, parse_condition, parse_content, process_octuple_midi
-
-from models.getmusic.utils.misc import seed_everything, merge_opts_to_config, modify_config_for_debug
-from models.getmusic.engine.logger import Logger
-from models.getmusic.engine.solver import Solver
-from models.getmusic.modeling.build import build_model
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
-from models.initializing import initialize
 
 from utils.utils import *
+from utils.jobs import JobStore, JobWorkerPool
+from utils.workspace import WorkspaceManager
+from utils.result_cache import ResultCache, file_sha256
+from utils.stage_cache import StageCache
+from utils.rendering import RenderService, mix_stems
+from utils.audio import AudioBuffer
+from utils.pipeline import StageGraph
+from utils.omr import OmrWorkerPool
+from utils.score import ScoreConverter, ingest_score
+from utils.readiness import BackgroundLoader
 
 import pickle
 import miditoolkit
 from models.getmusic.utils.midi_config import *
-from models.getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _key_chord_distribution,\
-    _key_chord_transition_distribution, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+from models.getmusic.utils.magenta_chord_recognition import infer_chords_for_sequence, _CHORDS, _PITCH_CLASS_NAMES, NO_CHORD
+# ts / duration / key-chord table 은 한 번 만들어 .npy 로 cache 한 것을 mmap 으로 읽음
+from models.getmusic.utils.tables import ts_dict, ts_list, dur_enc, dur_dec, key_profile, pos_in_bar, \
+    key_chord_loglik, key_chord_transition_loglik
 
 NODE_RANK = os.environ['INDEX'] if 'INDEX' in os.environ else 0
 NODE_RANK = int(NODE_RANK)
@@ -66,348 +61,457 @@ _CHORD_KIND_PITCHES = {
     'm7b5': [0, 3, 6, 10],
 }
 
-ts_dict = dict()
-ts_list = list()
-for i in range(0, max_ts_denominator + 1):  # 1 ~ 64
-    for j in range(1, ((2 ** i) * max_notes_per_bar) + 1):
-        ts_dict[(j, 2 ** i)] = len(ts_dict)
-        ts_list.append((j, 2 ** i))
-dur_enc = list()
-dur_dec = list()
-for i in range(duration_max):
-    for j in range(pos_resolution):
-        dur_dec.append(len(dur_enc))
-        for k in range(2 ** i):
-            dur_enc.append(len(dur_dec) - 1)
-
 tokens_to_ids = {}
 ids_to_tokens = []
 pad_index = None
 empty_index = None
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(current_dir, '../models/getmusic/utils/key_profile.pickle')
-key_profile = pickle.load(open(file_path, 'rb'))
-
-pos_in_bar = beat_note_factor * max_notes_per_bar * pos_resolution
-
-chord_pitch_out_of_key_prob = 0.01
-key_change_prob = 0.001
-chord_change_prob = 0.5
-key_chord_distribution = _key_chord_distribution(
-    chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-key_chord_loglik = np.log(key_chord_distribution)
-key_chord_transition_distribution = _key_chord_transition_distribution(
-    key_chord_distribution,
-    key_change_prob=key_change_prob,
-    chord_change_prob=chord_change_prob)
-key_chord_transition_loglik = np.log(key_chord_transition_distribution)
+
 
 router = APIRouter()
-mp3_to_midi = Mp3ToMIDIModel()
-args, Logger, solver, tokens_to_ids, ids_to_tokens, pad_index, empty_index = initialize()
+# '' (fp32) 또는 'int8'
+QUANTIZE = os.environ.get('HAI_QUANTIZE', '')
+# request 의 quality -> skip_step (diffusion step 100 개 기준 100 / 50 / 25 / 10 번의 denoiser pass)
+QUALITY_TIERS = {'high': 0, 'balanced': 1, 'fast': 3, 'draft': 9}
+# 'eager' 또는 'compile'
+DENOISER_BACKEND = os.environ.get('HAI_DENOISER_BACKEND', 'eager')
+# model 들은 startup 이후 background 에서 load (load_models), 그 전까지는 None
+mp3_to_midi = None
+args, Logger, solver = None, None, None
+scheduler = None
+result_cache = None
+# torch / basic-pitch (tensorflow) 를 쓰는 module 도 load_models 에서 import (router import 와 /healthz 가 바로 뜨도록)
+AUDIO_SAMPLE_RATE = None
+F, encode_midi, encode_note_events, encoding_to_MIDI, parse_condition, parse_content = None, None, None, None, None, None
+
+
+def load_models():
+    global mp3_to_midi, args, Logger, solver, tokens_to_ids, ids_to_tokens, pad_index, empty_index, scheduler, result_cache
+    global AUDIO_SAMPLE_RATE, F, encode_midi, encode_note_events, encoding_to_MIDI, parse_condition, parse_content
+
+    from models.music_models import Mp3ToMIDIModel, AUDIO_SAMPLE_RATE
+    from models.track_generation import F, encode_midi, encode_note_events, encoding_to_MIDI, parse_condition, parse_content
+    from models.initializing import initialize, unwrap_model
+    from models.inference_scheduler import MicroBatchScheduler, ContinuousBatchScheduler
+    from models.quantization import quantize_denoiser
+    from models.compiled_denoiser import CompiledDenoiser
+
+    mp3_to_midi = Mp3ToMIDIModel(num_workers=int(os.environ.get('HAI_TRANSCRIPTION_WORKERS', 2)),
+                                 max_batch_size=int(os.environ.get('HAI_TRANSCRIPTION_BATCH', 8)))
+    args, Logger, solver, tokens_to_ids, ids_to_tokens, pad_index, empty_index = initialize()
+    if QUANTIZE == 'int8':
+        # CPU serving 용 int8 dynamic quantization (python -m models.quantization 으로 export / 검증)
+        quantize_denoiser(solver, path=os.environ.get('HAI_QUANTIZED_PATH'), checkpoint_path=args.load_path)
+    if DENOISER_BACKEND == 'compile':
+        # sequence 길이 / batch bucket 별로 torch.compile 한 graph 사용, bucket 밖이면 eager
+        rfm = unwrap_model(solver.model).rfm
+        max_batch_size = int(os.environ.get('HAI_MAX_BATCH_SIZE', 4))
+        rfm.compiled_roformer = CompiledDenoiser(rfm.roformer, empty_index=rfm.num_classes - 2,
+                                                 lengths=[int(n) for n in os.environ.get('HAI_COMPILE_BUCKETS', '64,128,256,512').split(',')],
+                                                 batch_sizes=[2 ** i for i in range(max_batch_size.bit_length()) if 2 ** i < max_batch_size] + [max_batch_size],
+                                                 mode=os.environ.get('HAI_COMPILE_MODE') or None)
+    if os.environ.get('HAI_SCHEDULER', 'continuous') == 'micro_batch':
+        scheduler = MicroBatchScheduler(solver, use_ema=args.no_ema,
+                                        max_batch_size=int(os.environ.get('HAI_MAX_BATCH_SIZE', 4)),
+                                        max_wait=float(os.environ.get('HAI_BATCH_WAIT_MS', 50)) / 1000)
+    else:
+        scheduler = ContinuousBatchScheduler(solver, use_ema=args.no_ema,
+                                             max_active=int(os.environ.get('HAI_MAX_BATCH_SIZE', 4)))
+    scheduler.start()
+
+    result_cache = ResultCache(os.environ.get('HAI_RESULT_CACHE_DB', os.path.join(current_dir, '../../../data/results.sqlite3')),
+                               checkpoint_path=args.load_path,
+                               max_entries=int(os.environ.get('HAI_RESULT_CACHE_SIZE', 1000)))
+
+
+def warmup():
+    # 합성 입력으로 분석 / 채보 / encoding / sampling / rendering 을 한 번씩 돌려서
+    # numba JIT, cuDNN autotune, allocator, fluidsynth 초기화를 첫 request 전에 끝냄 (S3 / cache 는 사용하지 않음)
+    for i in range(int(os.environ.get('HAI_WARMUP_RUNS', 1))):
+        start = time.time()
+
+        t = np.arange(int(AUDIO_SAMPLE_RATE * 2), dtype=np.float32) / AUDIO_SAMPLE_RATE
+        y = (0.5 * np.sin(2 * np.pi * 440.0 * t)).astype(np.float32)
+        if ANALYSIS_MODE != 'symbolic':
+            extract_tempo(y=y, sr=AUDIO_SAMPLE_RATE)
+            extract_key(y=y, sr=AUDIO_SAMPLE_RATE)
+        mp3_to_midi.pred_audio(y, tempo=120)
+
+        midi = pretty_midi.PrettyMIDI(initial_tempo=120)
+        piano = pretty_midi.Instrument(program=0)
+        for j, pitch in enumerate([60, 62, 64, 65, 67, 69, 71, 72] * 2):
+            piano.notes.append(pretty_midi.Note(velocity=80, pitch=pitch, start=j * 0.5, end=(j + 1) * 0.5))
+        midi.instruments.append(piano)
+        midi_bytes = midi_to_bytes(midi)
+
+        conditional_track, condition_inst = parse_condition('p')
+        content_track = parse_content(os.environ.get('HAI_WARMUP_CONTENT', 'bd'))
+        encoded = encode_midi(midi_bytes, bool(conditional_track[-1]), condition_inst, args.chord_from_single)
+        x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc, have_cond = F(midi_bytes, conditional_track, content_track,
+                                                                                condition_inst, args.chord_from_single, tokens_to_ids,
+                                                                                ids_to_tokens, empty_index, pad_index, encoded=encoded)
+        scheduler.infer_sample(x, tempo, not_empty_pos, condition_pos)
+
+        renderer.encode_mp3(renderer.submit(mido_from_bytes(midi_bytes)).result())
+        print(f"warmup {i + 1}: {time.time() - start:.2f}s")
 
-<<<<<<< HEAD
 
-=======
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
 # mp3 input, midi input 나눠서
-@router.post("/start_generation/")
-async def start_generation(json_input: Request):
+def run_generation(input: GenerationInput, workdir: str, set_stage=lambda stage: None, set_partial=lambda partial: None):
 
     # 1. audio 다운로드 수행
-    body = await json_input.body()
-    body_dict = json.loads(body)
-    input = GenerationInput(**body_dict)
-<<<<<<< HEAD
+    set_stage('downloading')
     print(input)
     input_file_name = get_file_path_from_s3_url(s3_url=input.s3_url)
-    input_file_path = make_and_get_user_folder(file_name=input_file_name, user=input.user)    
+    input_file_path = os.path.join(workdir, input_file_name)
     print(input_file_path)
-=======
-
-    input_file_name = get_file_path_from_s3_url(s3_url=input.s3_url)
-    input_file_path = make_and_get_user_folder(file_name=input_file_name, user=input.user)    
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
     
-    download_from_s3_requests(s3_url=input.s3_url,
-                              local_file_path=input_file_path)
+    if not download_from_s3_requests(s3_url=input.s3_url,
+                                     local_file_path=input_file_path):
+        raise RuntimeError(f"failed to download {input.s3_url}")
+
+    # 같은 파일, 같은 설정으로 다시 요청한 경우 저장된 결과를 바로 반환
+    cache_fields = {"user": input.user, "instrument": input.instrument, "content_name": input.content_name,
+                    "ext": os.path.splitext(input_file_name)[1].lower()}
+    if input.quality != 'high':
+        cache_fields["quality"] = input.quality
+    if QUANTIZE:
+        # quantized model 의 결과는 fp32 결과와 다르므로 cache 를 공유하지 않음
+        cache_fields["quantize"] = QUANTIZE
+    # 분석 / encoding / mix 설정이 다르면 결과도 다름 (기본값이면 key 에 넣지 않아 기존 cache 를 그대로 사용)
+    if ANALYSIS_MODE != 'librosa':
+        cache_fields["analysis_mode"] = ANALYSIS_MODE
+    if DIRECT_ENCODING:
+        cache_fields["direct_encoding"] = True
+    if (ORIGIN_GAIN, GENERATED_GAIN) != (1.0, 1.0):
+        cache_fields["gains"] = [ORIGIN_GAIN, GENERATED_GAIN]
+    input_hash = file_sha256(input_file_path)
+    cache_key = result_cache.make_key(input_hash, cache_fields, args.seed)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print(f"result cache hit: {cache_key}")
+        return cached
     
+    # 2~8 단계를 stage DAG 로 선언하고, 의존성이 풀린 stage 부터 동시에 실행
+    graph = StageGraph(stage_pool, set_stage=set_stage)
+
     # 2. mp3 -> midi 예측 수행
     if input_file_name.endswith('mid'):
-<<<<<<< HEAD
-        midi_obj = miditoolkit.midi.parser.MidiFile(input_file_path)
-        
-        resolution = midi_obj.ticks_per_beat
-        origin_tempo = midi_obj.tempo_changes[0].tempo
-        midi_file_path = input_file_path
-
-        midi_data = mido.MidiFile(midi_file_path, ticks_per_beat=resolution)
-        midi_data_origin = copy.deepcopy(midi_data)
-
-        midi_data = change_instrument(instrument=input.instrument, mid=midi_data)
-        midi_data.save(midi_file_path)
-
-        if len(midi_data.tracks) >= 2:
-            new_track = mido.MidiTrack()
-            for msg in midi_data.tracks[0]:
-                if isinstance(msg, mido.MetaMessage):
-                    new_track.append(msg)
-                else:
-                    if 'velocity' in msg.dict():
-                        msg.velocity = 0
-                        new_track.append(msg)
+        def ingest_midi():
+            midi_obj = miditoolkit.midi.parser.MidiFile(input_file_path)
             
-            second_track = midi_data.tracks[1:]
-            midi_data.tracks = [new_track]
-            for t in second_track:
-                midi_data.tracks.append(t)
-        
-        midi_file_path = midi_file_path.split('.')[0] + "_acc.mid"
-        midi_data.save(midi_file_path)
-        midi_path = midi_file_path
+            resolution = midi_obj.ticks_per_beat
+            origin_tempo = midi_obj.tempo_changes[0].tempo
+            midi_file_path = input_file_path
 
-    elif input_file_name.endswith('pdf'):
-        gradle_cmd = "./audiveris/gradlew"
-        mxl_path = '/'.join(input_file_path.split('/')[:-1])
-        cmd_args = f"-batch,-export,-output,{mxl_path},--,{input_file_path}"
-        gradle_args = f"-PcmdLineArgs=\"{cmd_args}\""
-        java_args = "-Dorg.gradle.jvmargs='-Djava.awt.headless=true'"
-        full_command = f"{gradle_cmd} run {gradle_args} {java_args}" 
-        
-        os.system(full_command)
-        
-        mxl_file = mxl_path + "/" + input_file_name.split('.')[0] + '.mxl'
-        midi_path = mxl_path + "/" + input_file_name.split('.')[0] + '.mid'
-        
-        mxl_to_mid_command = f"xvfb-run -a mscore -o {midi_path} {mxl_file}"
-        os.system(mxl_to_mid_command)
-        
-        midi_data = mido.MidiFile(midi_path)
-
-        origin_tempo = input.tempo
-        midi_data = change_tempo(midi_data, origin_tempo)
-        midi_data_origin = copy.deepcopy(midi_data)
-        
-        if len(midi_data.tracks) >= 2:
-            new_track = mido.MidiTrack()
-            for msg in midi_data.tracks[0]:
-                if isinstance(msg, mido.MetaMessage):
-                    new_track.append(msg)
-                else:
-                    if 'velocity' in msg.dict():
-                        msg.velocity = 0
-                        new_track.append(msg)
-
-            second_track=midi_data.tracks[1:]
-            midi_data.tracks = [new_track]
-            for t in second_track:
-                midi_data.tracks.append(t)
-        
-        midi_file_path = midi_path.split('.')[0] + "_acc.mid"
-        midi_data.save(midi_file_path)
-        midi_path = midi_file_path
-        resolution = 480
-
-    else:
-        if not input_file_path.endswith('.mp3'):
-            audio_file_path = make_audio_to_mp3(audio_path=input_file_path)
+            midi_data = mido.MidiFile(midi_file_path, ticks_per_beat=resolution)
+            midi_data_origin = copy.deepcopy(midi_data)
 
-        audio_file_path = input_file_path
-        tempo = extract_tempo(audio_path=audio_file_path)[0]
-        
-        key = extract_key(audio_path=audio_file_path)
+            midi_data = change_instrument(instrument=input.instrument, mid=midi_data)
 
-        model_output, midi_data, note_events = mp3_to_midi.pred(audio_path=audio_file_path, tempo=tempo)
-        resolution = midi_data.resolution
+            if len(midi_data.tracks) >= 2:
+                new_track = mido.MidiTrack()
+                for msg in midi_data.tracks[0]:
+                    if isinstance(msg, mido.MetaMessage):
+                        new_track.append(msg)
+                    else:
+                        if 'velocity' in msg.dict():
+                            msg.velocity = 0
+                            new_track.append(msg)
+                
+                second_track = midi_data.tracks[1:]
+                midi_data.tracks = [new_track]
+                for t in second_track:
+                    midi_data.tracks.append(t)
+            
+            # 중간 midi 는 파일 대신 bytes 로 넘김
+            midi_bytes = midi_to_bytes(midi_data)
+            return {"origin": midi_data_origin, "origin_after": midi_bytes, "midi": midi_bytes, "resolution": resolution}
 
-        midi_file_path = f"{input_file_path.split('.')[0]}.mid"
-        midi_data.write(midi_file_path)
-        midi_data_origin = copy.deepcopy(midi_data)
+        graph.add('source', ingest_midi)
 
-        # change to mido.MidiFile
-        midi_data = mido.MidiFile(midi_file_path, ticks_per_beat=resolution)
-        midi_data = change_tempo(mid=midi_data, tempo=tempo)
-        midi_data = change_key_signature(mid=midi_data, key_signature=key)
-        midi_data.save(midi_file_path)
-    
-        # 3. instrument 변경 (midi의 instrument 바꿔주기)   
-        midi_data = change_instrument(instrument=input.instrument, mid=midi_data)
-
-        # 4. 반주가 있는 경우는 반주 활용, 멜로디만 있는 경우는 멜로디 활용 반주 생성
-        midi_data.save('origin.mid')
- 
-        melody_path, accompaniment_path = separate_melody(midi_file=midi_data, midi_path=midi_file_path, resolution=resolution)    
-        midi_path = accompaniment_path
-    
+    elif input_file_name.endswith('pdf'):
+        def read_score():
+            # 상주하는 OMR worker 에 맡기고 .mxl 경로를 받음 (gradle / JVM 을 request 마다 띄우지 않음)
+            mxl_file = omr_workers.recognize(input_file_path, workdir)
 
+            # mxl -> midi 는 xvfb-run mscore 대신 music21 로 변환
+            return score_converter.to_midi(mxl_file)
 
-    # preprocessing 라인 # 반주만 넣어주기
-    ###########################################################################################
+        # 악보 인식 (audiveris + music21 변환) 은 같은 pdf 면 결과가 같음
+        graph.add('score', lambda: stage_cache.memoize('score', input_hash, read_score))
+        graph.add('source', ingest_score, deps=['score'])
 
-    # 4. encoding
-=======
-        midi_data = pretty_midi.PrettyMIDI(input_file_path)
     else:
-        audio_file_path = make_audio_to_mp3(audio_path=input_file_path)
-        tempo = extract_tempo(file_path=audio_file_path)
-        key = extract_key(file_path=audio_file_path)
-
-        model_output, midi_data, note_events = mp3_to_midi.pred(audio_path=audio_file_path, tempo=tempo)
-        midi_file_path = f"{input_file_path.split('.')[0]}.mid"
-        midi_data.write(midi_file_path)
-        
-        change_tempo(midi_path=midi_file_path, tempo=tempo)
-        change_key_signature(midi_path=midi_file_path, key_signature=key)
+        # 한 번만 decode 해서 tempo / key / 채보가 같은 buffer 를 사용 (mp3 재인코딩 없음)
+        audio = AudioBuffer(input_file_path)
+
+        # 같은 upload 에 대해서는 분석/채보/반주 분리 결과가 항상 같으므로 input hash 로 memoize
+        # note_events 는 초 단위라 tempo 와 무관하게 먼저 채보할 수 있음
+        def transcribe():
+            # window 가 끝날 때마다 그때까지 채보된 note (start_s, end_s, pitch, amplitude) 를 job 상태로 공개
+            def on_notes(done, total, notes):
+                set_partial({"notes": [[round(float(n[0]), 3), round(float(n[1]), 3), int(n[2]), round(float(n[3]), 3)] for n in notes],
+                             "windows": done, "total_windows": total})
+
+            model_output, midi_data, note_events = mp3_to_midi.pred_audio(audio.at(AUDIO_SAMPLE_RATE), tempo=120,
+                                                                          on_progress=lambda done, total: set_stage(f"notes {done}/{total}"),
+                                                                          on_notes=on_notes)
+            return note_events
+
+        def analyze():
+            y = audio.at(22050)
+            tempo = extract_tempo(y=y, sr=22050)[0]
+            key = extract_key(y=y, sr=22050)
+            return tempo, key
+
+        def analyze_symbolic(notes):
+            # CQT / beat tracking 없이 채보된 note 로 추정, 실패하면 librosa 로 fallback
+            tempo = estimate_tempo_from_notes(notes)
+            key = estimate_key_from_notes(notes, key_profile)
+            if tempo is None or key is None:
+                return stage_cache.memoize('analysis', input_hash, analyze)
+            return tempo, key
+
+        def accompany(notes, analysis):
+            tempo, key = analysis
+            midi_data_origin = mp3_to_midi.notes_to_midi(notes, tempo)
+            resolution = midi_data_origin.resolution
+            transcribed_bytes = midi_to_bytes(midi_data_origin)
+
+            if DIRECT_ENCODING:
+                # 반주 midi 를 만들지 않고 encoding 단계에서 note_events 를 바로 사용
+                midi_data = mido_from_bytes(transcribed_bytes)
+                midi_data = change_tempo(mid=midi_data, tempo=tempo)
+                midi_data = change_key_signature(mid=midi_data, key_signature=key)
+                return {"origin": midi_data_origin, "origin_after": midi_to_bytes(midi_data), "midi": None,
+                        "resolution": resolution, "notes": notes, "tempo": tempo}
+
+            def separate():
+                # change to mido.MidiFile
+                midi_data = mido_from_bytes(transcribed_bytes)
+                midi_data = change_tempo(mid=midi_data, tempo=tempo)
+                midi_data = change_key_signature(mid=midi_data, key_signature=key)
+                origin_after_bytes = midi_to_bytes(midi_data)
+            
+                # 3. instrument 변경 (midi의 instrument 바꿔주기)   
+                midi_data = change_instrument(instrument=input.instrument, mid=midi_data)
+
+                # 4. 반주가 있는 경우는 반주 활용, 멜로디만 있는 경우는 멜로디 활용 반주 생성
+                melody_midi, accompaniment_midi = separate_melody(midi_file=midi_data, resolution=resolution)
+                return origin_after_bytes, midi_to_bytes(accompaniment_midi)
+
+            origin_after_bytes, midi_bytes = stage_cache.memoize('accompaniment', stage_cache.make_key(input_hash, input.instrument, tempo, key),
+                                                                 separate)
+            return {"origin": midi_data_origin, "origin_after": origin_after_bytes, "midi": midi_bytes, "resolution": resolution}
+
+        # librosa 분석과 채보는 서로 독립이라 동시에 수행
+        graph.add('notes', lambda: stage_cache.memoize('notes', input_hash, transcribe))
+        if ANALYSIS_MODE == 'symbolic':
+            graph.add('analysis', lambda notes: stage_cache.memoize('analysis_symbolic', input_hash, lambda: analyze_symbolic(notes)),
+                      deps=['notes'])
+        else:
+            graph.add('analysis', lambda: stage_cache.memoize('analysis', input_hash, analyze))
+        graph.add('source', accompany, deps=['notes', 'analysis'])
 
-        
-        midi_data = mido.MidiFile(midi_file_path)
-        # 2-1. tempo, key, beat 등등 정보 추가
-
-    # 3. instrument 변경 (midi의 instrument 바꿔주기)
-    processed_midi_data = change_instrument(instrument=input.instrument,
-                                            midi_object=midi_data)
-
-    # 4. 반주가 있는 경우는 반주 활용, 멜로디만 있는 경우는 멜로디 활용 반주 생성
-    # if 반주?:
-        # melody_path, accompaniment_path = separate_melody(midi_file_path)    
-    # else:
-        # make accompaniment
-    
-    ### 최종 저장
-    midi_file_path = f"{input_file_path.split('.')[0]}_after.mid"
-    processed_midi_data.write(midi_file_path)
-    
     # preprocessing 라인 # 반주만 넣어주기
     ###########################################################################################
 
-    # 4. condition / midi parsing
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
+    # 4. encoding
     conditional_track, condition_inst = parse_condition(input.instrument)
     content_track = parse_content(input.content_name)
-    
-    print("###############################################################")
-    print("encoding start")
-    x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc, have_cond = F(midi_path, conditional_track, content_track, 
-                                                                            condition_inst, args.chord_from_single, tokens_to_ids,
-                                                                            ids_to_tokens, empty_index, pad_index)
+
+    def encoding(source):
+        midi_bytes = source["midi"]
+        with_chord = bool(conditional_track[-1])
+        # encoding 은 content track 과 무관 (content track 은 F 에서 mask 로만 반영)
+        if source.get("notes") is not None:
+            encoded = stage_cache.memoize('encoding_notes', stage_cache.make_key(input_hash, source["tempo"], input.instrument, condition_inst,
+                                                                                 with_chord, args.chord_from_single),
+                                          lambda: encode_note_events(source["notes"], source["tempo"], input.instrument,
+                                                                     with_chord, condition_inst, args.chord_from_single))
+        else:
+            encoded = stage_cache.memoize('encoding', stage_cache.make_key(hashlib.sha256(midi_bytes).hexdigest(), condition_inst,
+                                                                           with_chord, args.chord_from_single),
+                                          lambda: encode_midi(midi_bytes, with_chord, condition_inst, args.chord_from_single))
+        x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc, have_cond = F(midi_bytes, conditional_track, content_track, 
+                                                                                condition_inst, args.chord_from_single, tokens_to_ids,
+                                                                                ids_to_tokens, empty_index, pad_index, encoded=encoded)
+        return x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc
 
     # 5. inference
-    oct_line = solver.infer_sample(x, tempo, not_empty_pos, condition_pos, use_ema=args.no_ema)
+    def sampling(encoding):
+        x, tempo, not_empty_pos, condition_pos, pitch_shift, tpc = encoding
+        return scheduler.infer_sample(x, tempo, not_empty_pos, condition_pos, skip_step=QUALITY_TIERS[input.quality])
 
     # 6. decoding
-    data = oct_line.split(' ')
-    oct_final_list = []
-    for start in range(3, len(data),8):
-        if 'pad' not in data[start] and 'pad' not in data[start+1]:
-            pitch = int(data[start][:-1].split('-')[1])
-            if data[start-1] != '<2-129>' and data[start-1] != '<2-128>':
-                pitch -= pitch_shift
-            data[start] = '<3-{}>'.format(pitch) # re-normalize            
-            oct_final_list.append(' '.join(data[start-3:start+5]))
-    oct_final = ' '.join(oct_final_list)
-    
-    midi_obj = encoding_to_MIDI(oct_final, tpc, args.decode_chord)
-
-    # 7. storing files
-    generated_midi_file_path = f"{input_file_path.split('.')[0]}_generated.mid"
-    midi_obj.dump(generated_midi_file_path)
-
-    s3_client = get_s3_client()
-    folder_path = make_s3_folder(s3_client=s3_client, user=input.user)
-<<<<<<< HEAD
-=======
-    # s3_url = upload_to_s3(local_file_name=midi_file_path_1,
-    #                       key=f"{folder_path}{input_file_name.split('.')[0]}_origin_before.mid")
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
-    s3_url = upload_to_s3(local_file_name=midi_file_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_origin_after.mid")
-    s3_url = upload_to_s3(local_file_name=generated_midi_file_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_generated.mid")
-<<<<<<< HEAD
-
-    # 8. midi post processing
-    ### 8-1. sync
-
-    midi_data = mido.MidiFile(generated_midi_file_path, ticks_per_beat=resolution)
-    midi_origin_data = mido.MidiFile(midi_file_path, ticks_per_beat=resolution)
-
-    output_path = f"{input_file_path.split('.')[0]}_generated_sync.mid"
-    midi_data = change_tempo_of_midi(mid=midi_data)
-    midi_data.save(output_path)
-    s3_url = upload_to_s3(local_file_name=output_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_generated_sync.mid")
-=======
-
-    ####################################################################################################
-    # 멜로디와 합쳐주기
-    # 합쳐준 것 1개, 안 합친 것 1개
-    # 결과물 velocity 조절하기
-
-
-    # 8. midi post processing
-    ### 8-1. sync
-    output_path = f"{input_file_path.split('.')[0]}_generated_sync.mid"
-    change_tempo_of_midi(original_file_path=midi_file_path, generated_file_path=generated_midi_file_path, output_path=output_path)
-    s3_url = upload_to_s3(local_file_name=output_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_generated_sync.mid")
-    
-    ### 8-2. remove the created
-    file_path = generated_midi_file_path
-    output_path = f"{input_file_path.split('.')[0]}_generated_sync_remove.mid"
-    remove_instrument_events(file_path, input.instrument, output_path)
-    s3_url = upload_to_s3(local_file_name=generated_midi_file_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_fin.mid")
-    
-    ### 8-3. mp3 변환
-    def convert_midi_to_mp3(input_midi, output_mp3):
-        subprocess.run(['timidity', input_midi, '-Ow', '-o', 'output.wav'])
-        subprocess.run(['lame', 'output.wav', output_mp3])
-    
-    output_path = f"{input_file_path.split('.')[0]}_generated_sync_remove_fin.mp3"
-    convert_midi_to_mp3(generated_midi_file_path, output_path)
-    s3_url = upload_to_s3(local_file_name=output_path,
-                          key=f"{folder_path}{input_file_name.split('.')[0]}_generated.mp3")
->>>>>>> acf6a3b79554c974d03c97b5e3ae8924912c0720
-
-    ### 8-3. mix with original
-    output_path = f"{midi_file_path.split('.')[0]}_generated_sync_remove_fin.mid"
-    midi_data_fin = modify_midi_velocity(midi_data)
-    midi_data_fin.ticks_per_beat = resolution
+    def decoding(sampling, encoding):
+        pitch_shift, tpc = encoding[4], encoding[5]
+        data = sampling.split(' ')
+        oct_final_list = []
+        for start in range(3, len(data),8):
+            if 'pad' not in data[start] and 'pad' not in data[start+1]:
+                pitch = int(data[start][:-1].split('-')[1])
+                if data[start-1] != '<2-129>' and data[start-1] != '<2-128>':
+                    pitch -= pitch_shift
+                data[start] = '<3-{}>'.format(pitch) # re-normalize            
+                oct_final_list.append(' '.join(data[start-3:start+5]))
+        oct_final = ' '.join(oct_final_list)
+        
+        midi_obj = encoding_to_MIDI(oct_final, tpc, args.decode_chord)
+        return midi_to_bytes(midi_obj)
+
+    # 7. midi post processing
+    ### 7-1. sync
+    def sync(decoding):
+        midi_data = mido_from_bytes(decoding)
+        midi_data = change_tempo_of_midi(mid=midi_data)
+        return midi_to_bytes(midi_data)
+
+    ### 7-2. mix with original
+    def render_generated(sync, source):
+        midi_data_fin = modify_midi_velocity(mido_from_bytes(sync))
+        midi_data_fin.ticks_per_beat = source["resolution"]
+        return renderer.submit(midi_data_fin).result()
+
+    def render_origin(source):
+        # origin 렌더링은 sampling 을 기다리지 않고 바로 시작
+        return renderer.submit(source["origin"]).result()
+
+    def mix(render_origin, render_generated):
+        # mp3 를 다시 decode 하지 않고 PCM 에서 바로 mix
+        return mix_stems([render_origin, render_generated], gains=[ORIGIN_GAIN, GENERATED_GAIN])
+
+    # 8. storing files
+    storage = get_storage()
+    stem = input_file_name.split('.')[0]
+
+    def upload(data, suffix, hashed=False):
+        def run(user_prefix, **deps):
+            content = data(**deps)
+            # 결과 mp3 는 내용 hash 로 key 를 만들어서 기존 파일 존재 여부(HEAD)를 확인하지 않음
+            if hashed:
+                key = storage.content_key(f"{user_prefix}{stem}{suffix}", content, '.mp3')
+            else:
+                key = f"{user_prefix}{stem}{suffix}"
+            return storage.upload_bytes(content, key)
+        return run
+
+    graph.add('encoding', encoding, deps=['source'])
+    graph.add('sampling', sampling, deps=['encoding'])
+    graph.add('decoding', decoding, deps=['sampling', 'encoding'])
+    graph.add('sync', sync, deps=['decoding'])
+    graph.add('render_generated', render_generated, deps=['sync', 'source'])
+    graph.add('render_origin', render_origin, deps=['source'])
+    graph.add('mix', mix, deps=['render_origin', 'render_generated'])
+    graph.add('encode_acc', lambda render_generated: renderer.encode_mp3(render_generated), deps=['render_generated'])
+    graph.add('encode_ai', lambda mix: renderer.encode_mp3(mix), deps=['mix'])
+    graph.add('user_prefix', lambda: storage.user_prefix(input.user))
+    graph.add('upload_origin_after', upload(lambda source: source["origin_after"], "_origin_after.mid"), deps=['user_prefix', 'source'])
+    graph.add('upload_generated', upload(lambda decoding: decoding, "_generated.mid"), deps=['user_prefix', 'decoding'])
+    graph.add('upload_sync', upload(lambda sync: sync, "_generated_sync.mid"), deps=['user_prefix', 'sync'])
+    graph.add('upload_acc', upload(lambda encode_acc: encode_acc, "_acc", hashed=True), deps=['user_prefix', 'encode_acc'])
+    graph.add('upload_ai', upload(lambda encode_ai: encode_ai, "_ai", hashed=True), deps=['user_prefix', 'encode_ai'])
+
+    results = graph.run()
+    print(f"stage timings: {graph.summary()}")
+
+    s3_acc_url, s3_ai_url = results['upload_acc'], results['upload_ai']
     
-    try:
-        midi_data_origin.save('origin.mid')
-    except Exception as e:
-        midi_data_origin.write('origin.mid')
-    midi_data_fin.save('generated.mid')
-    midi_origin_data.save('origin_acc.mid')
-
-    convert_midi_to_mp3('generated.mid', 'generated.mp3')
-    convert_midi_to_mp3('origin.mid', 'origin.mp3')
-
-    sound1 = AudioSegment.from_file("origin.mp3")
-    sound2 = AudioSegment.from_file("generated.mp3")
-    min_length = min(len(sound1), len(sound2))
-
-    sound1 = sound1[:min_length]
-    sound2 = sound2[:min_length]
-    combined = sound1.overlay(sound2)
-    combined.export("combined.mp3", format="mp3")
-    random_no=generate_random_string(4)
-
-    if check_file_exists('capstone-midi-generated', f"{folder_path}{input_file_name.split('.')[0]}_acc.mp3"):
-        acc_name = f"{input_file_name.split('.')[0]}_acc_{random_no}.mp3"
-        s3_acc_url = upload_to_s3(local_file_name="generated.mp3", key=f"{folder_path}{acc_name}")
-    else:
-        s3_acc_url = upload_to_s3(local_file_name="generated.mp3",
-                                  key=f"{folder_path}{input_file_name.split('.')[0]}_acc.mp3")
+    result = {"url": s3_acc_url, "url2": s3_ai_url}
+    if s3_acc_url is not None and s3_ai_url is not None:
+        result_cache.put(cache_key, result)
+    return result
+
+
+def run_job(payload: dict, set_stage, set_partial):
+    with workspaces.workspace() as workdir:
+        return run_generation(GenerationInput(**payload), workdir, set_stage=set_stage, set_partial=set_partial)
+
+
+workspaces = WorkspaceManager(root=os.environ.get('HAI_WORKSPACE_ROOT'),
+                              max_bytes=int(os.environ.get('HAI_WORKSPACE_MAX_MB', 2048)) * 1024 ** 2,
+                              ttl_seconds=int(os.environ.get('HAI_WORKSPACE_TTL', 3600)),
+                              heartbeat_seconds=int(os.environ.get('HAI_WORKSPACE_HEARTBEAT', 30)))
+# 'librosa' (chroma_cqt / beat_track) 또는 'symbolic' (채보된 note 에서 key / tempo 추정)
+ANALYSIS_MODE = os.environ.get('HAI_ANALYSIS_MODE', 'librosa')
+# 오디오 입력에서 반주 midi 를 거치지 않고 note_events -> encoding 으로 바로 변환
+DIRECT_ENCODING = os.environ.get('HAI_DIRECT_ENCODING', '0') == '1'
+# stem 별 mix gain
+ORIGIN_GAIN = float(os.environ.get('HAI_ORIGIN_GAIN', 1.0))
+GENERATED_GAIN = float(os.environ.get('HAI_GENERATED_GAIN', 1.0))
+# 한 request 의 stage 들을 동시에 실행하는 pool (job worker 들이 공유)
+stage_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('HAI_STAGE_WORKERS', 8)), thread_name_prefix='stage')
+omr_workers = OmrWorkerPool(num_workers=int(os.environ.get('HAI_OMR_WORKERS', 1)),
+                            timeout=int(os.environ.get('HAI_OMR_TIMEOUT', 300)))
+score_converter = ScoreConverter(num_workers=int(os.environ.get('HAI_SCORE_WORKERS', 1)))
+renderer = RenderService(num_workers=int(os.environ.get('HAI_RENDER_WORKERS', 2)))
+stage_cache = StageCache(os.environ.get('HAI_STAGE_CACHE_DIR', os.path.join(current_dir, '../../../data/stage_cache')),
+                         max_bytes=int(os.environ.get('HAI_STAGE_CACHE_MAX_MB', 1024)) * 1024 ** 2)
+job_store = JobStore(os.environ.get('HAI_JOB_DB', os.path.join(current_dir, '../../../data/jobs.sqlite3')))
+job_workers = JobWorkerPool(job_store, run_job, num_workers=int(os.environ.get('HAI_JOB_WORKERS', 2)))
+
+
+model_loader = BackgroundLoader(load_models, warmup=warmup if int(os.environ.get('HAI_WARMUP_RUNS', 1)) > 0 else None,
+                                on_ready=lambda: job_workers.start())
+
+
+@router.on_event("startup")
+def start_model_loader():
+    # model load / warmup 은 background 에서 진행, 그동안 들어온 job 은 job store 에서 대기
+    model_loader.start()
+
+
+@router.on_event("shutdown")
+def stop_job_workers():
+    job_workers.stop(timeout=5)
+    if scheduler is not None:
+        scheduler.stop(timeout=5)
+    if mp3_to_midi is not None:
+        mp3_to_midi.engine.stop(timeout=5)
+    omr_workers.stop(timeout=5)
+    score_converter.close()
+
+
+@router.get("/healthz")
+async def healthz():
+    # process 가 살아있는지만 확인 (model load 중이어도 200)
+    return {"status": "200", **model_loader.status()}
+
+
+@router.get("/readyz")
+async def readyz():
+    if not model_loader.ready:
+        raise HTTPException(status_code=503, detail=model_loader.status())
+    return {"status": "200", **model_loader.status()}
 
-    if check_file_exists('capstone-midi-generated', f"{folder_path}{input_file_name.split('.')[0]}_ai.mp3"):
-        ai_name = f"{input_file_name.split('.')[0]}_ai_{random_no}.mp3"
-        s3_ai_url = upload_to_s3(local_file_name="combined.mp3",
-                                 key=f"{folder_path}{ai_name}")
-    else:
-        s3_ai_url = upload_to_s3(local_file_name="combined.mp3",
-                                  key=f"{folder_path}{input_file_name.split('.')[0]}_ai.mp3")
-    
-    return {"status": "200", "url": s3_acc_url, "url2": s3_ai_url}
\ No newline at end of file
+
+@router.post("/start_generation/")
+async def start_generation(json_input: Request):
+    body = await json_input.body()
+    body_dict = json.loads(body)
+    input = GenerationInput(**body_dict)
+    if input.quality not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"unknown quality {input.quality}, expected one of {list(QUALITY_TIERS)}")
+
+    job_id = job_store.submit(input.dict())
+    job_workers.notify()
+
+    return {"status": "200", "job_id": job_id}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+
+    response = {"status": "200", "job_id": job_id, "state": job['state'], "stage": job['stage']}
+    if job['partial'] is not None:
+        response['partial'] = job['partial']
+    if job['result'] is not None:
+        response.update(job['result'])
+    if job['error'] is not None:
+        response['error'] = job['error']
+    return response
\ No newline at end of file